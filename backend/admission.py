@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException, status
+
+from .auth import get_current_user
+from .models import UserInDB
+
+# Lower value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Per-endpoint defaults: (max concurrent, max queued)
+DEFAULT_LIMITS = {
+    "detect": (4, 16),
+    "segment": (2, 8),
+    "analyze": (4, 32),
+    "report": (4, 32),
+}
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursting up to `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount=1.0):
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def seconds_until(self, amount=1.0):
+        if self.tokens >= amount or self.rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class EndpointLimiter:
+    """
+    Bounds concurrency for one endpoint with a bounded priority wait queue.
+    When every slot is busy and the queue is full, callers are rejected
+    immediately instead of piling up.
+    """
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.avg_service_time = 1.0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+
+    def retry_after(self):
+        """Rough estimate (seconds) of when a slot will free up."""
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(self.avg_service_time * backlog / self.max_concurrency))
+
+    def _reject(self, detail):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    async def acquire(self, priority):
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(f"Server busy: {self.name} queue is full")
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # Timed out or the client went away. wait_for can raise after the
+            # slot was already handed to us, so pass it on rather than leak it
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                self._discard(entry)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(f"Server busy: timed out waiting for {self.name}")
+            raise
+
+    def _discard(self, entry):
+        try:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        except ValueError:
+            pass
+
+    def release(self, service_time=None):
+        if service_time is not None:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+
+        # Hand the slot directly to the highest-priority waiter
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(True)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    """Per-endpoint concurrency/queue limits plus per-user token buckets."""
+    def __init__(self):
+        self.queue_timeout = _env_float("ADMISSION_QUEUE_TIMEOUT", 10.0)
+        self.user_rate = _env_float("ADMISSION_USER_RATE", 2.0)
+        self.user_burst = _env_float("ADMISSION_USER_BURST", 10.0)
+        self.max_tracked_users = 10000
+        self.limiters = {}
+        for name, (concurrency, queue) in DEFAULT_LIMITS.items():
+            self.limiters[name] = EndpointLimiter(
+                name,
+                _env_int(f"ADMISSION_{name.upper()}_CONCURRENCY", concurrency),
+                _env_int(f"ADMISSION_{name.upper()}_QUEUE", queue),
+                self.queue_timeout,
+            )
+        self.buckets = {}
+
+    def _bucket_for(self, username):
+        bucket = self.buckets.get(username)
+        if bucket is None:
+            if len(self.buckets) >= self.max_tracked_users:
+                # Drop idle users; a full bucket is the same as a fresh one
+                self.buckets = {u: b for u, b in self.buckets.items() if not b.is_full()}
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self.buckets[username] = bucket
+        return bucket
+
+    def check_rate(self, username):
+        bucket = self._bucket_for(username)
+        if not bucket.try_consume():
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(bucket.seconds_until())))},
+            )
+
+    def admit(self, endpoint):
+        """
+        Returns a FastAPI dependency that holds a slot on `endpoint` for the
+        lifetime of the request. Send `X-Priority: batch` for bulk traffic.
+        """
+        limiter = self.limiters[endpoint]
+
+        async def dependency(
+            current_user: UserInDB = Depends(get_current_user),
+            x_priority: Optional[str] = Header(None),
+        ):
+            self.check_rate(current_user.username)
+            priority = PRIORITY_BATCH if (x_priority or "").lower() == "batch" else PRIORITY_INTERACTIVE
+            await limiter.acquire(priority)
+            start = time.monotonic()
+            try:
+                yield
+            finally:
+                limiter.release(time.monotonic() - start)
+
+        return dependency
+
+
+admission = AdmissionController()
@@ -0,0 +1,155 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from .database import db
+
+appointments_collection = db.appointments
+
+# Booked slots returned by default: today plus this many days
+BOOKED_WINDOW_DAYS = int(os.getenv("APPOINTMENT_WINDOW_DAYS", "14"))
+# Other workers' bookings only reach this process's cache once an entry expires;
+# the unique index still rejects the double-booking itself
+SLOT_CACHE_TTL = float(os.getenv("APPOINTMENT_CACHE_TTL", "30"))
+# /appointments/booked is public and takes any doctor_name, so the cache must stay bounded
+SLOT_CACHE_MAX_ENTRIES = int(os.getenv("APPOINTMENT_CACHE_MAX_ENTRIES", "10000"))
+
+# Field order matches the booked-slot query, so it is answered from the index alone
+SLOT_INDEX = [("doctor_name", 1), ("appointment_date", 1), ("appointment_time", 1)]
+SLOT_PROJECTION = {"_id": 0, "appointment_date": 1, "appointment_time": 1}
+
+
+class SlotTaken(Exception):
+    pass
+
+
+class SlotCache:
+    """
+    Booked times per (doctor, day), held in process memory as an LRU of at
+    most `max_entries` keys. Every entry carries the counter value it was
+    written under: invalidation bumps the counter and leaves a tombstone,
+    and put() refuses to overwrite an entry stamped later than the reader's
+    token, so a read that raced a booking never replaces a fresher view.
+    """
+    def __init__(self, ttl=SLOT_CACHE_TTL, max_entries=SLOT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counter = 0
+
+    def token(self):
+        """Taken before reading from Mongo and passed back to put()."""
+        return self._counter
+
+    def get(self, doctor_name, day):
+        key = (doctor_name, day)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is None:
+            return None
+        times, stored_at, _ = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return times
+
+    def _set(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, doctor_name, day, times, token):
+        key = (doctor_name, day)
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] > token:
+            return
+        self._set(key, (sorted(times), time.monotonic(), token))
+
+    def invalidate(self, doctor_name, day):
+        self._counter += 1
+        self._set((doctor_name, day), (None, time.monotonic(), self._counter))
+
+
+slot_cache = SlotCache()
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_time(value):
+    return datetime.strptime(value, "%H:%M").strftime("%H:%M")
+
+
+async def ensure_indexes():
+    try:
+        await appointments_collection.create_index(SLOT_INDEX, unique=True, name="unique_slot")
+    except OperationFailure as e:
+        # Existing duplicates block the unique index until they are cleaned up
+        print(f"Could not create unique appointment slot index: {e}")
+
+
+async def booked_slots(doctor_name, start, end):
+    """
+    Returns [{"date", "time"}] booked for `doctor_name` between `start` and
+    `end` (inclusive date objects). Days missing from the cache are
+    fetched with a single range query.
+    """
+    days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    booked = {}
+    missing = []
+    for day in days:
+        times = slot_cache.get(doctor_name, day)
+        if times is None:
+            missing.append(day)
+        else:
+            booked[day] = times
+
+    if missing:
+        token = slot_cache.token()
+        fetched = {day: [] for day in missing}
+        cursor = appointments_collection.find(
+            {"doctor_name": doctor_name, "appointment_date": {"$gte": missing[0], "$lte": missing[-1]}},
+            SLOT_PROJECTION,
+        )
+        async for row in cursor:
+            day = row["appointment_date"]
+            if day in fetched:
+                fetched[day].append(row["appointment_time"])
+        for day, times in fetched.items():
+            slot_cache.put(doctor_name, day, times, token)
+            booked[day] = sorted(times)
+
+    return [{"date": day, "time": t} for day in days for t in booked[day]]
+
+
+async def upcoming_booked_slots(doctor_name, days=BOOKED_WINDOW_DAYS):
+    today = datetime.utcnow().date()
+    return await booked_slots(doctor_name, today, today + timedelta(days=days))
+
+
+async def book(patient_id, doctor_name, appointment_date, appointment_time):
+    """
+    Inserts the appointment; the unique slot index makes the insert itself
+    the availability check. Raises SlotTaken if someone else holds the slot.
+    """
+    doc = {
+        "patient_id": patient_id,
+        "doctor_name": doctor_name,
+        "appointment_date": appointment_date,
+        "appointment_time": appointment_time,
+        "status": "booked",
+        "created_at": datetime.utcnow(),
+    }
+    try:
+        result = await appointments_collection.insert_one(doc)
+    except DuplicateKeyError:
+        raise SlotTaken(f"{doctor_name} is already booked on {appointment_date} at {appointment_time}")
+    finally:
+        # Either way this day's cached view is now out of date
+        slot_cache.invalidate(doctor_name, appointment_date)
+    return str(result.inserted_id)
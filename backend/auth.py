@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+import os
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -49,4 +50,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     user = await db.users.find_one({"username": token_data.username})
     if user is None:
         raise credentials_exception
-    return UserInDB(**user)
+    return UserInDB(**user, id=str(user["_id"]))
+
+# Comma-separated usernames allowed to manage models and other admin endpoints
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+
+async def get_admin_user(current_user: UserInDB = Depends(get_current_user)):
+    if current_user.username not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
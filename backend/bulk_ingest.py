@@ -0,0 +1,130 @@
+import os
+from datetime import datetime
+
+import orjson
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from .database import db
+from .models import ReportCreate
+from . import report_stats
+from .responses import dumps
+
+DEFAULT_CHUNK_SIZE = int(os.getenv("BULK_INGEST_CHUNK_SIZE", "500"))
+MAX_CHUNK_SIZE = 5000
+
+
+def iter_ndjson(body):
+    """Yields (index, line) for each non-blank line of an NDJSON body."""
+    index = 0
+    start = 0
+    while start < len(body):
+        end = body.find(b"\n", start)
+        if end == -1:
+            end = len(body)
+        line = body[start:end]
+        start = end + 1
+        if line.strip():
+            yield index, line
+            index += 1
+
+
+def iter_records(body, content_type):
+    """Yields (index, raw bytes or parsed object) from a JSON array or NDJSON body."""
+    if "ndjson" in content_type or "jsonl" in content_type:
+        yield from iter_ndjson(body)
+        return
+
+    data = orjson.loads(body)
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of report records")
+    yield from enumerate(data)
+
+
+def format_recommendations(recommendations):
+    # Same text layout generate_report stores
+    if isinstance(recommendations, list):
+        return "\n".join([f"- {r}" for r in recommendations])
+    return recommendations or "No specific recommendations provided."
+
+
+def build_document(record, doctor_id):
+    return {
+        "patient_id": record.patient_id,
+        "doctor_id": doctor_id,
+        "doctor_name": record.doctor_name,
+        "disorder": record.disorder,
+        "confidence": float(record.confidence),
+        "severity": record.severity,
+        "notes": record.notes,
+        "detailed_analysis": record.detailed_analysis,
+        "recommendations": format_recommendations(record.recommendations),
+        "damage_location": record.damage_location,
+        "is_annotated_image": record.is_annotated_image,
+        "created_at": record.created_at or datetime.utcnow(),
+        "image_url": record.image_url or "placeholder_url",
+    }
+
+
+async def _flush(batch):
+    """Unordered insert_many for one chunk. Yields a status per record."""
+    docs = [doc for _, doc in batch]
+    failed = {}
+    try:
+        await db.reports.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed[error["index"]] = error.get("errmsg", "write failed")
+
+    # Roll up before yielding: the client may disconnect mid-chunk, and the
+    # rows are already written
+    await report_stats.record_reports([doc for position, doc in enumerate(docs) if position not in failed])
+
+    for position, (index, doc) in enumerate(batch):
+        if position in failed:
+            yield {"index": index, "status": "failed", "error": failed[position]}
+        else:
+            # insert_many assigns _id client-side before sending
+            yield {"index": index, "status": "inserted", "id": str(doc["_id"])}
+
+
+async def ingest(body, content_type, doctor_id, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Validates records with ReportCreate and writes them in chunks. Yields
+    one NDJSON status line per record, then a summary line.
+
+    `body` must be read by the endpoint before the response starts: below
+    ASGI spec 2.4 StreamingResponse listens for disconnects while streaming
+    and that listener drains http.request messages, so reading the request
+    from inside the generator hangs or loses records.
+    """
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    counts = {"inserted": 0, "invalid": 0, "failed": 0}
+    batch = []
+
+    async def flush():
+        async for status in _flush(batch):
+            counts[status["status"]] += 1
+            yield dumps(status) + b"\n"
+        batch.clear()
+
+    try:
+        for index, raw in iter_records(body, content_type):
+            try:
+                data = orjson.loads(raw) if isinstance(raw, (bytes, str)) else raw
+                record = ReportCreate(**data)
+            except (orjson.JSONDecodeError, ValidationError, TypeError) as e:
+                counts["invalid"] += 1
+                yield dumps({"index": index, "status": "invalid", "error": str(e)}) + b"\n"
+                continue
+            batch.append((index, build_document(record, doctor_id)))
+            if len(batch) >= chunk_size:
+                async for line in flush():
+                    yield line
+        if batch:
+            async for line in flush():
+                yield line
+    except (orjson.JSONDecodeError, ValueError) as e:
+        yield dumps({"status": "error", "error": f"Malformed request body: {e}"}) + b"\n"
+
+    yield dumps({"summary": counts}) + b"\n"
@@ -0,0 +1,64 @@
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Trips to OPEN after `failure_threshold` consecutive failures and rejects
+    calls until `reset_timeout` seconds have passed. It then lets a single
+    probe through (HALF_OPEN): success closes the circuit, failure re-opens it.
+    A probe that reports neither within `probe_timeout` seconds (the caller
+    failed or was cancelled before making the call) expires, and the next
+    request becomes the probe. Thread-safe, since remote calls run in worker
+    threads.
+    """
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0, probe_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = reset_timeout if probe_timeout is None else probe_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            # HALF_OPEN: only one probe at a time, until it reports back or expires
+            if self._probe_in_flight and now - self._probe_started_at < self.probe_timeout:
+                return False
+            self._probe_in_flight = True
+            self._probe_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"Circuit '{self.name}' closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"Circuit '{self.name}' opened after {self.failures} failure(s)")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+# Matches the resize applied by /segment before U-Net inference
+DEFAULT_SIZE = 256
+DEFAULT_SHARD_SIZE = 1024
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def read_yolo_labels(label_path):
+    """
+    Parses a YOLO label file.
+    Each line is either a box (class cx cy w h) or a polygon
+    (class x1 y1 x2 y2 ...), all coordinates normalized to 0-1.
+    Returns:
+        List of (class_id, points) with points as an (N, 2) float array.
+    """
+    labels = []
+    if not os.path.exists(label_path):
+        return labels
+
+    with open(label_path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            cls = int(float(parts[0]))
+            coords = np.array([float(v) for v in parts[1:]], dtype=np.float32)
+            if len(coords) == 4:
+                # Box label: convert to its four corners
+                cx, cy, w, h = coords
+                points = np.array([
+                    [cx - w / 2, cy - h / 2],
+                    [cx + w / 2, cy - h / 2],
+                    [cx + w / 2, cy + h / 2],
+                    [cx - w / 2, cy + h / 2],
+                ], dtype=np.float32)
+            else:
+                points = coords[: len(coords) // 2 * 2].reshape(-1, 2)
+            labels.append((cls, points))
+    return labels
+
+
+def rasterize_labels(labels, size):
+    """Draws all label polygons into a single binary (size x size) mask."""
+    mask = np.zeros((size, size), dtype=np.uint8)
+    for _, points in labels:
+        pixel_points = np.round(np.clip(points, 0.0, 1.0) * (size - 1)).astype(np.int32)
+        cv2.fillPoly(mask, [pixel_points], 1)
+    return mask
+
+
+def load_sample(args):
+    """Decodes, resizes and rasterizes one image/label pair (runs in a worker process)."""
+    image_path, label_path, size = args
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    # Store RGB to match PIL's convert("RGB") at inference time
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+
+    labels = read_yolo_labels(label_path)
+    mask = rasterize_labels(labels, size)
+
+    # One bit per class present in the image (data.yaml has nc: 7)
+    class_bits = 0
+    for cls, _ in labels:
+        class_bits |= 1 << cls
+    return img, mask, class_bits
+
+
+def list_split(dataset_root, split):
+    """Returns sorted (image_path, label_path) pairs for a split."""
+    image_dir = os.path.join(dataset_root, split, "images")
+    label_dir = os.path.join(dataset_root, split, "labels")
+    pairs = []
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stem = os.path.splitext(name)[0]
+        pairs.append((os.path.join(image_dir, name), os.path.join(label_dir, stem + ".txt")))
+    return pairs
+
+
+def pack_split(dataset_root, split, out_dir, size=DEFAULT_SIZE, shard_size=DEFAULT_SHARD_SIZE, workers=None):
+    """
+    Packs one split of a YOLO dataset into memory-mapped .npy shards.
+    Each shard holds `images` (N, size, size, 3) uint8, `masks` (N, size, size) uint8
+    and `classes` (N,) uint8 class bitmasks. A manifest.json lists the shards.
+    """
+    pairs = list_split(dataset_root, split)
+    split_dir = os.path.join(out_dir, split)
+    os.makedirs(split_dir, exist_ok=True)
+
+    shards = []
+    skipped = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for shard_idx, start in enumerate(range(0, len(pairs), shard_size)):
+            chunk = pairs[start:start + shard_size]
+            samples = pool.map(load_sample, [(img, lbl, size) for img, lbl in chunk], chunksize=16)
+
+            prefix = os.path.join(split_dir, f"shard_{shard_idx:04d}")
+            images = np.lib.format.open_memmap(prefix + "_images.npy", mode="w+", dtype=np.uint8, shape=(len(chunk), size, size, 3))
+            masks = np.lib.format.open_memmap(prefix + "_masks.npy", mode="w+", dtype=np.uint8, shape=(len(chunk), size, size))
+            classes = np.zeros(len(chunk), dtype=np.uint8)
+
+            count = 0
+            for (image_path, _), sample in zip(chunk, samples):
+                if sample is None:
+                    skipped.append(image_path)
+                    continue
+                images[count], masks[count], classes[count] = sample
+                count += 1
+
+            images.flush()
+            masks.flush()
+            del images, masks
+            np.save(prefix + "_classes.npy", classes[:count])
+
+            shards.append({"prefix": os.path.basename(prefix), "count": count})
+            print(f"[{split}] shard {shard_idx}: {count} samples")
+
+    manifest = {
+        "split": split,
+        "size": size,
+        "total": sum(s["count"] for s in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(split_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if skipped:
+        print(f"[{split}] skipped {len(skipped)} unreadable images")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a YOLO dataset into memory-mapped training shards.")
+    parser.add_argument("--dataset", default="BoneFractureYolo8", help="Dataset root containing train/valid/test")
+    parser.add_argument("--out", default=os.path.join("packed", "BoneFractureYolo8"), help="Output directory")
+    parser.add_argument("--splits", nargs="+", default=["train", "valid", "test"])
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE)
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    for split in args.splits:
+        if not os.path.isdir(os.path.join(args.dataset, split, "images")):
+            print(f"Skipping missing split: {split}")
+            continue
+        pack_split(args.dataset, split, args.out, args.size, args.shard_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Builds an /analyze-shaped result from local YOLO detections, so clients can
+# render something before (or instead of) the Gemini narrative.
+
+# Dataset classes (BoneFractureYolo8/data.yaml) -> disorder names shown to users
+CLASS_TO_DISORDER = {
+    "elbow positive": "Elbow Fracture",
+    "fingers positive": "Finger Fracture",
+    "forearm fracture": "Forearm Fracture",
+    "humerus fracture": "Humerus Fracture",
+    "humerus": "Humerus Abnormality",
+    "shoulder fracture": "Shoulder Fracture",
+    "wrist positive": "Wrist Fracture",
+}
+
+# The detector gives no calibrated score for "nothing found"
+NO_FINDING_CONFIDENCE = 0.5
+
+
+def disorder_for_class(label):
+    return CLASS_TO_DISORDER.get(label, str(label).title())
+
+
+def box_to_damage_location(bbox, width, height):
+    """Converts pixel [x1, y1, x2, y2] into the normalized x/y/width/height used by reports."""
+    x1, y1, x2, y2 = bbox
+    return {
+        "x": max(0.0, x1 / width),
+        "y": max(0.0, y1 / height),
+        "width": min(1.0, (x2 - x1) / width),
+        "height": min(1.0, (y2 - y1) / height),
+    }
+
+
+def detections_to_result(detections, width, height):
+    """
+    Returns a dict with the same keys as the Gemini analysis (disorder,
+    confidence, severity, notes, detailed_analysis, recommendations,
+    damage_location) built only from detector output.
+    """
+    if not detections:
+        return {
+            "disorder": "Healthy",
+            "confidence": NO_FINDING_CONFIDENCE,
+            "severity": "None",
+            "notes": "No fracture was detected by the local model.",
+            "detailed_analysis": "The local fracture detector found no regions of interest in this scan.",
+            "recommendations": ["Have a radiologist review the scan to confirm"],
+            "damage_location": None,
+            "source": "local",
+        }
+
+    ranked = sorted(detections, key=lambda d: d["confidence"], reverse=True)
+    primary = ranked[0]
+    disorder = disorder_for_class(primary["class"])
+    findings = ", ".join(
+        f"{disorder_for_class(d['class']).lower()} ({d['confidence'] * 100:.0f}%)" for d in ranked
+    )
+    return {
+        "disorder": disorder,
+        "confidence": primary["confidence"],
+        # Severity cannot be judged from a bounding box alone
+        "severity": "Undetermined",
+        "notes": f"Local model detected signs of {disorder.lower()}.",
+        "detailed_analysis": f"The local fracture detector found {len(ranked)} region(s) of interest: {findings}.",
+        "recommendations": [
+            "Have a radiologist review the highlighted region",
+            "Consult an orthopedic specialist",
+            "Immobilize the affected area until reviewed",
+        ],
+        "damage_location": box_to_damage_location(primary["bbox"], width, height),
+        "source": "local",
+    }
@@ -1,19 +1,29 @@
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status, Form, Query
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 import uvicorn
-import random
 import io
 import os
 import json
+import base64
+import asyncio
 from datetime import timedelta, datetime
+from typing import Optional
 from .utils import preprocess_image
-from .auth import create_access_token, get_current_user, verify_password, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
+from .auth import create_access_token, get_current_user, get_admin_user, verify_password, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
 from .database import db
-from .models import UserCreate, User, Token, ReportCreate, UserInDB
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+from .admission import admission
+from . import report_stats
+from .responses import FastJSONResponse, CompressionMiddleware, conditional_json, sse_event
+from .local_analysis import detections_to_result
+from .circuit_breaker import CircuitBreaker
+from .phash_index import fingerprint, detection_cache
+from .pdf_reports import create_pdf_report
+from . import report_export
+from . import bulk_ingest
+from . import triage
+from . import appointments
+from .models import UserCreate, User, Token, ReportCreate, UserInDB, AppointmentCreate
 from fastapi.responses import StreamingResponse
 import google.generativeai as genai
 from dotenv import load_dotenv
@@ -23,27 +33,22 @@ load_dotenv() # Reload triggered
 
 # Configure Gemini
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "20"))
+gemini_breaker = CircuitBreaker(
+    "gemini",
+    failure_threshold=int(os.getenv("GEMINI_BREAKER_FAILURES", "3")),
+    reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET", "30")),
+    # A half-open probe that hasn't reported back by the time the call itself would time out is presumed lost
+    probe_timeout=GEMINI_TIMEOUT,
+)
+
+# Models are loaded (and hot-swapped) through the registry; see startup below
+from .model_registry import model_registry, MODEL_DIR, MODEL_EXTENSIONS
+
+# Screens the 224x224 preprocessed film before the full pipeline
+triage_classifier = triage.TriageClassifier()
 
-# Initialize YOLOv8 Model
-from .yolo_model import YoloModel
-try:
-    yolo_model = YoloModel() 
-    print("YOLOv8 model loaded successfully.")
-except Exception as e:
-    print(f"Failed to load YOLOv8 model: {e}")
-    yolo_model = None
-
-# Initialize U-Net Model
-from .unet_model import UNetInference
-try:
-    # Check for weights file
-    unet_weights = "unet_fracture.pth" if os.path.exists("unet_fracture.pth") else None
-    unet_model = UNetInference(model_path=unet_weights)
-except Exception as e:
-    print(f"Failed to init U-Net: {e}")
-    unet_model = None
-
-app = FastAPI(title="Bone & Joint Disorder Detection API")
+app = FastAPI(title="Bone & Joint Disorder Detection API", default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -52,6 +57,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
 
 @app.on_event("startup")
 async def startup_db_client():
@@ -59,6 +65,10 @@ async def startup_db_client():
         # Ping the database to check connection
         await db.command("ping")
         print("Successfully connected to MongoDB!")
+
+        await report_stats.ensure_indexes()
+        await report_stats.backfill_if_needed()
+        await appointments.ensure_indexes()
         
         # Admin user seeding removed as per requirement
         # existing_admin = await db.users.find_one({"username": "admin"})
@@ -75,6 +85,12 @@ async def startup_db_client():
     except Exception as e:
         print(f"Failed to connect to MongoDB: {e}")
 
+@app.on_event("startup")
+async def startup_models():
+    await model_registry.start()
+    # Pick up versions activated by other workers
+    asyncio.create_task(model_registry.watch())
+
 @app.get("/")
 def read_root():
     return {"message": "Bone & Joint Disorder Detection API is running"}
@@ -114,241 +130,218 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me", response_model=User)
-async def read_users_me(current_user: UserInDB = Depends(get_current_user)):
-    return current_user
+async def read_users_me(request: Request, current_user: UserInDB = Depends(get_current_user)):
+    user = User(id=current_user.id or "", username=current_user.username, full_name=current_user.full_name)
+    return conditional_json(request, user.dict())
+
+def run_gemini_analysis(pil_image):
+    """Asks Gemini for a structured diagnosis. Raises on API or parsing errors."""
+    model = genai.GenerativeModel('gemini-1.5-flash')
+    prompt = """
+    Analyze this medical X-ray image as an expert radiologist. Identify any bone disorders, fractures, or abnormalities.
+    Return the result ONLY as a JSON object with the following keys:
+    - disorder: The name of the detected disorder (or "Healthy" if none).
+    - confidence: A number between 0 and 1 representing confidence.
+    - severity: "Mild", "Moderate", or "Severe" (or "None" if healthy).
+    - notes: A concise summary of the findings (max 2 sentences).
+    - detailed_analysis: A detailed technical explanation of the visual findings, including specific bone structures affected.
+    - recommendations: A list of 3-5 recommended next steps or treatments.
+    - damage_location: An object with x, y, width, height (all as floats between 0.0 and 1.0 representing percentage of image dimensions) representing the bounding box of the primary issue. If no issue or unsure, return null.
+    """
+
+    response = model.generate_content([prompt, pil_image], request_options={"timeout": GEMINI_TIMEOUT})
+
+    # Clean up response text to ensure it's valid JSON
+    response_text = response.text.replace("```json", "").replace("```", "").strip()
+    result = json.loads(response_text)
+
+    # Ensure damage_location has valid values if present
+    if not result.get('damage_location'):
+         # Fallback for damage location if model doesn't return it
+         result['damage_location'] = {"x": 0.2, "y": 0.2, "width": 0.4, "height": 0.4}
+
+    result.setdefault("source", "gemini")
+    return result
+
+def gemini_available():
+    """False when there is no key or the breaker is open, so callers skip the remote call entirely."""
+    return bool(os.getenv("GEMINI_API_KEY")) and gemini_breaker.allow_request()
+
+NO_ANALYSIS_DETAIL = "Analysis is temporarily unavailable: the local model is not loaded and Gemini cannot be reached"
+
+def local_analysis(pil_image, yolo, detections=None):
+    """Structured result from local YOLO detections; 503 when YOLO isn't loaded either, rather than a made-up diagnosis."""
+    if detections is None:
+        if not yolo:
+            raise HTTPException(status_code=503, detail=NO_ANALYSIS_DETAIL)
+        detections = yolo.model.detect_fractures(pil_image.convert("RGB"))
+    width, height = pil_image.size
+    return detections_to_result(detections, width, height)
+
+def call_gemini(pil_image):
+    """
+    Runs the Gemini call and reports the outcome to the breaker. Returns None
+    on failure. The outcome is recorded in the calling thread, so a cancelled
+    caller can't leave a half-open probe unresolved.
+    """
+    try:
+        result = run_gemini_analysis(pil_image)
+    except Exception as e:
+        gemini_breaker.record_failure()
+        print(f"Gemini API Error: {e}")
+        return None
+    gemini_breaker.record_success()
+    return result
+
+def run_triage(contents, override=False):
+    """Scores the 224x224 preprocessed film; None when triage is disabled or has no weights."""
+    if not triage_classifier.active:
+        return None
+    return triage_classifier.assess(preprocess_image(contents), override)
+
+def analyze_with_fallback(pil_image, yolo, detections=None):
+    if gemini_available():
+        result = call_gemini(pil_image)
+        if result is not None:
+            return result
+    return local_analysis(pil_image, yolo, detections)
 
 @app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user)):
+async def analyze_image(
+    file: UploadFile = File(...),
+    full: bool = Query(False, description="Skip triage and always run the full analysis"),
+    current_user: UserInDB = Depends(get_current_user),
+    admitted: None = Depends(admission.admit("analyze")),
+):
     contents = await file.read()
-    
-    # Preprocess image (Resize only)
-    processed_img = preprocess_image(contents)
+
+    # Confident normals skip YOLO/Gemini entirely
+    decision = await asyncio.to_thread(run_triage, contents, full)
+    if decision and decision["skip"]:
+        await triage.log_decision(db, current_user.username, decision)
+        return triage.normal_result(decision)
     
     # Convert to PIL Image for Gemini
     pil_image = PIL.Image.open(io.BytesIO(contents))
+    yolo = model_registry.get("yolo")
 
-    try:
-        api_key = os.getenv("GEMINI_API_KEY")
-        print(f"DEBUG: API Key found: {bool(api_key)}")
-        if api_key:
-            print(f"DEBUG: API Key start: {api_key[:4]}...")
-        
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt = """
-        Analyze this medical X-ray image as an expert radiologist. Identify any bone disorders, fractures, or abnormalities.
-        Return the result ONLY as a JSON object with the following keys:
-        - disorder: The name of the detected disorder (or "Healthy" if none).
-        - confidence: A number between 0 and 1 representing confidence.
-        - severity: "Mild", "Moderate", or "Severe" (or "None" if healthy).
-        - notes: A concise summary of the findings (max 2 sentences).
-        - detailed_analysis: A detailed technical explanation of the visual findings, including specific bone structures affected.
-        - recommendations: A list of 3-5 recommended next steps or treatments.
-        - damage_location: An object with x, y, width, height (all as floats between 0.0 and 1.0 representing percentage of image dimensions) representing the bounding box of the primary issue. If no issue or unsure, return null.
-        """
-        
-        print("DEBUG: Sending request to Gemini...")
-        response = model.generate_content([prompt, pil_image])
-        print("DEBUG: Response received from Gemini")
-        
-        # Clean up response text to ensure it's valid JSON
-        response_text = response.text.replace("```json", "").replace("```", "").strip()
-        print(f"DEBUG: Response text: {response_text[:100]}...")
-        result = json.loads(response_text)
-        
-        # Ensure damage_location has valid values if present
-        if not result.get('damage_location'):
-             # Fallback for damage location if model doesn't return it
-             result['damage_location'] = {"x": 0.2, "y": 0.2, "width": 0.4, "height": 0.4}
+    result = await asyncio.to_thread(analyze_with_fallback, pil_image, yolo)
+    if decision:
+        await triage.log_decision(db, current_user.username, decision, result)
+    return result
 
-        return result
+@app.post("/analyze/stream")
+async def analyze_image_stream(
+    file: UploadFile = File(...),
+    full: bool = Query(False, description="Skip triage and always run the full analysis"),
+    current_user: UserInDB = Depends(get_current_user),
+    admitted: None = Depends(admission.admit("analyze")),
+):
+    """
+    Streaming variant of /analyze over Server-Sent Events. A film that
+    triage scores as clearly normal gets a single `triage` result and
+    `done`. Otherwise the stream emits `accepted`,
+    `detections` (with a preliminary result from the local model), `mask`,
+    `analysis` (Gemini, or the local result while Gemini is unavailable) and
+    `done`, each as soon as its stage finishes. With neither model available
+    the stream ends with an `error` event for the analysis stage instead.
+    """
+    contents = await file.read()
+    yolo = model_registry.get("yolo")
+    unet = model_registry.get("unet")
+
+    async def events():
+        # Triage before anything else, so a skipped film doesn't start a Gemini call
+        decision = await asyncio.to_thread(run_triage, contents, full)
+        if decision and decision["skip"]:
+            await triage.log_decision(db, current_user.username, decision)
+            yield sse_event("triage", triage.normal_result(decision))
+            yield sse_event("done", {})
+            return
+
+        # Decode before asking the breaker: a corrupt upload must fail before it
+        # is granted the half-open probe, not after
+        pil_image = PIL.Image.open(io.BytesIO(contents)).convert("RGB")
+        width, height = pil_image.size
 
-    except Exception as e:
-        print(f"Gemini API Error: {e}")
-        import traceback
-        traceback.print_exc()
-        # Fallback to mock if API fails (e.g. no key)
-        disorders = ["Fracture", "Arthritis", "Osteoporosis", "Joint Dislocation", "Tissue Damage"]
-        prediction = random.choice(disorders)
-        confidence = random.uniform(0.85, 0.99)
-        return {
-            "disorder": prediction,
-            "confidence": confidence,
-            "severity": "Moderate",
-            "notes": f"Detected signs of {prediction.lower()} in the provided scan. Recommended further consultation. (Mock Analysis - API Error)",
-            "detailed_analysis": "Mock detailed analysis: The scan shows potential irregularities in the bone structure. Further investigation is required to confirm the diagnosis.",
-            "recommendations": ["Consult an orthopedic specialist", "Schedule an MRI for better visualization", "Rest and immobilize the affected area"],
-            "damage_location": {"x": 0.3, "y": 0.3, "width": 0.2, "height": 0.2}
-        }
-
-def create_pdf_report(buffer, data, image_bytes=None):
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Header
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(50, height - 50, "OrthoAI Diagnostic Report")
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(50, height - 80, "Generated by AI Analysis System")
-    c.line(50, height - 90, width - 50, height - 90)
-    
-    # Patient/Doctor Info
-    doctor_name = data.get("doctor_name") or data.get("doctor_id") or "Unknown"
-    c.drawString(50, height - 120, f"Doctor: {doctor_name}")
-    c.drawString(50, height - 140, f"Patient ID: {data.get('patient_id', 'Unknown')}")
-    created_at = data.get("created_at", datetime.now())
-    if isinstance(created_at, str):
-         # Try parsing if string
-         try: created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-         except: pass
-    date_str = created_at.strftime('%Y-%m-%d') if isinstance(created_at, datetime) else str(created_at)
-    c.drawString(300, height - 120, f"Date: {date_str}")
-    
-    # Patient Image
-    img_y_bottom = height - 400
-    img_display_h = 250
-    img_display_w = 250
-    img_x_left = 50
-    
-    if image_bytes:
+        # Start the slow remote call first so it overlaps with local inference;
+        # skip it entirely while Gemini is unavailable
+        gemini_task = None
+        if gemini_available():
+            gemini_task = asyncio.create_task(asyncio.to_thread(call_gemini, pil_image.copy()))
         try:
-            img = ImageReader(io.BytesIO(image_bytes))
-            orig_w, orig_h = img.getSize()
-            aspect = orig_w / orig_h
-            
-            # Calculate scale to fit in 250x250
-            scale = min(img_display_w / orig_w, img_display_h / orig_h)
-            drawn_w = orig_w * scale
-            drawn_h = orig_h * scale
-            
-            # Center the image in the box
-            offset_x = (img_display_w - drawn_w) / 2
-            offset_y = (img_display_h - drawn_h) / 2
-            final_x = img_x_left + offset_x
-            final_y = img_y_bottom + offset_y
-            
-            c.drawImage(img, final_x, final_y, width=drawn_w, height=drawn_h)
-            
-            # Draw Bounding Box if exists AND not using an already annotated image
-            if not data.get("is_annotated_image"):
-                damage_loc = data.get("damage_location")
-                if damage_loc and isinstance(damage_loc, dict):
-                    x = float(damage_loc.get("x", 0))
-                    y = float(damage_loc.get("y", 0))
-                    w = float(damage_loc.get("width", 0))
-                    h = float(damage_loc.get("height", 0))
-                    
-                    # Check for normalized coordinates (usually < 1)
-                    # If they are not normalized, we assume they are percentages anyway based on Gemini prompt
-                    
-                    # Calculate PDF coordinates
-                    # Image/Canvas origin is Top-Left. PDF origin is Bottom-Left.
-                    # Box X (from left of image) = x * drawn_w
-                    # Box Y (from TOP of image) = y * drawn_h
-                    
-                    rect_x = final_x + (x * drawn_w)
-                    rect_y_top = final_y + drawn_h - (y * drawn_h)
-                    rect_y_bottom = rect_y_top - (h * drawn_h)
-                    
-                    # Make circle instead of ellipse
-                    # Use max dimension for radius to cover area
-                    orig_w_px = w * drawn_w
-                    orig_h_px = h * drawn_h
-                    max_dim = max(orig_w_px, orig_h_px)
-                    
-                    diameter = max_dim * 1.2
-                    radius = diameter / 2
-                    
-                    # Center of original box
-                    center_x = rect_x + (orig_w_px / 2)
-                    center_y_abs = rect_y_top - (orig_h_px / 2) # Y grows UP in PDF from bottom
-                    
-                    c.setStrokeColorRGB(1, 0, 0) # Red
-                    c.setLineWidth(3)
-                    
-                    # c.circle(x_cen, y_cen, radius, stroke=1, fill=0)
-                    c.circle(center_x, center_y_abs, radius, stroke=1, fill=0)
-                    
-                    c.setStrokeColorRGB(0, 0, 0) # Reset to black
-                
-        except Exception as e:
-            print(f"Error drawing image: {e}")
-            c.drawString(50, height - 200, "Image could not be processed")
-    else:
-        c.drawString(50, height - 300, "[Image Placeholder - Image not stored in DB]")
-    
-    # Results Summary
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(350, height - 180, "Analysis Summary")
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(350, height - 210, f"Disorder: {data.get('disorder', 'N/A')}")
-    c.drawString(350, height - 230, f"Confidence: {float(data.get('confidence', 0))*100:.1f}%")
-    c.drawString(350, height - 250, f"Severity: {data.get('severity', 'N/A')}")
-    
-    # Detailed Analysis
-    y_position = height - 450
-    if data.get('detailed_analysis'):
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y_position, "Detailed Analysis")
-        y_position -= 20
-        c.setFont("Helvetica", 11)
-        
-        analysis_lines = []
-        current_line = ""
-        words = (data.get('detailed_analysis') or "").split()
-        for word in words:
-            if c.stringWidth(current_line + " " + word, "Helvetica", 11) < 500:
-                current_line += " " + word
-            else:
-                analysis_lines.append(current_line)
-                current_line = word
-        analysis_lines.append(current_line)
-        
-        for line in analysis_lines:
-            c.drawString(50, y_position, line)
-            y_position -= 15
-        y_position -= 10
-
-    # Recommendations
-    if data.get('recommendations'):
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y_position, "Recommendations")
-        y_position -= 20
-        c.setFont("Helvetica", 11)
-        
-        rec_lines = (data.get('recommendations') or "").split('\n')
-        for line in rec_lines:
-            c.drawString(50, y_position, line)
-            y_position -= 15
-        y_position -= 10
-
-    # Clinical Notes
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y_position, "Clinical Notes")
-    y_position -= 20
-    c.setFont("Helvetica", 11)
-    c.drawString(50, y_position, data.get('notes', ''))
-    
-    # Footer
-    c.setFont("Helvetica-Oblique", 10)
-    c.drawString(50, 50, "Disclaimer: This report is generated by AI and should be verified by a medical professional.")
-    
-    c.save()
-    
+            yield sse_event("accepted", {"filename": file.filename, "width": width, "height": height})
+
+            # None means the local model didn't run, which is not the same as "found nothing"
+            detections = None
+            if yolo:
+                try:
+                    detections = await asyncio.to_thread(yolo.model.detect_fractures, pil_image)
+                except Exception as e:
+                    print(f"YOLO inference failed: {e}")
+                    yield sse_event("error", {"stage": "detections", "detail": str(e)})
+            yield sse_event("detections", {
+                "detections": detections or [],
+                "preliminary": detections_to_result(detections, width, height) if detections is not None else None,
+                "model_version": yolo.version if yolo else None,
+            })
+
+            try:
+                segmentation = await asyncio.to_thread(segment_image, contents, unet, yolo, detections or [])
+                yield sse_event("mask", segmentation)
+            except Exception as e:
+                print(f"Segmentation failed: {e}")
+                yield sse_event("error", {"stage": "mask", "detail": str(e)})
+
+            analysis = await gemini_task if gemini_task is not None else None
+            if analysis is None:
+                if detections is None:
+                    yield sse_event("error", {"stage": "analysis", "detail": NO_ANALYSIS_DETAIL})
+                    return
+                analysis = detections_to_result(detections, width, height)
+            yield sse_event("analysis", analysis)
+            if decision:
+                await triage.log_decision(db, current_user.username, decision, analysis)
+            yield sse_event("done", {})
+        finally:
+            # Client disconnected early: don't leave the task's result unobserved
+            if gemini_task is not None and not gemini_task.done():
+                gemini_task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def decode_and_fingerprint(contents):
+    pil_image = PIL.Image.open(io.BytesIO(contents)).convert("RGB")
+    image_hash, thumb = fingerprint(pil_image)
+    return pil_image, image_hash, thumb
+
 @app.post("/detect")
-async def detect_fractures(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user)):
-    if not yolo_model:
+async def detect_fractures(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user), admitted: None = Depends(admission.admit("detect"))):
+    # Hold on to this handle so a concurrent hot-swap doesn't change models mid-request
+    yolo = model_registry.get("yolo")
+    if not yolo:
         raise HTTPException(status_code=500, detail="YOLOv8 model not loaded")
     
     contents = await file.read()
     
-    # Preprocess if needed (YOLO usually handles raw images well, but we need PIL/numpy)
-    pil_image = PIL.Image.open(io.BytesIO(contents))
+    # Decoding and inference run off the event loop, so the admission limits
+    # bound real concurrency and queued requests can still be turned away fast
+    pil_image, image_hash, thumb = await asyncio.to_thread(decode_and_fingerprint, contents)
+
+    # Re-encoded or resized copies of an image we've already seen reuse its detections
+    detections = detection_cache.lookup(yolo, image_hash, thumb, pil_image.size)
+    # Returning the response directly skips jsonable_encoder on this hot path
+    if detections is not None:
+        return FastJSONResponse({"detections": detections, "model_version": yolo.version, "cached": True})
     
-    detections = yolo_model.detect_fractures(pil_image)
+    detections = await asyncio.to_thread(yolo.model.detect_fractures, pil_image)
+    detection_cache.store(yolo, image_hash, thumb, pil_image.size, detections)
     
-    return {"detections": detections}
+    return FastJSONResponse({"detections": detections, "model_version": yolo.version, "cached": False})
 
 @app.post("/report")
 async def generate_report(
@@ -364,7 +357,8 @@ async def generate_report(
     doctor_name: str = Form(None),
     is_annotated_image: bool = Form(False),
     save_only: bool = Query(False),
-    current_user: UserInDB = Depends(get_current_user)
+    current_user: UserInDB = Depends(get_current_user),
+    admitted: None = Depends(admission.admit("report"))
 ):
     contents = await file.read()
     
@@ -407,6 +401,7 @@ async def generate_report(
     }
     
     result = await db.reports.insert_one(report_data)
+    await report_stats.record_report(report_data)
     
     if save_only:
         return {"message": "Report saved successfully", "report_id": str(result.inserted_id)}
@@ -418,17 +413,71 @@ async def generate_report(
     
     return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=report.pdf"})
 
-@app.get("/reports")
-async def get_reports(current_user: UserInDB = Depends(get_current_user)):
-    reports = await db.reports.find({"doctor_id": current_user.username}).to_list(length=100)
-    # Convert ObjectId to string for JSON serialization
-    for report in reports:
-        report["id"] = str(report["_id"])
-        del report["_id"]
-    return reports
-
+@app.post("/reports/bulk")
+async def bulk_ingest_reports(
+    request: Request,
+    chunk_size: int = Query(bulk_ingest.DEFAULT_CHUNK_SIZE, ge=1, le=bulk_ingest.MAX_CHUNK_SIZE),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    Ingests a JSON array or NDJSON body (Content-Type: application/x-ndjson)
+    of ReportCreate records with unordered insert_many in chunks. Streams back
+    one NDJSON status line per record and a final summary.
+    """
+    # Read the whole body here; see bulk_ingest.ingest for why the generator can't
+    body = await request.body()
+    return StreamingResponse(
+        bulk_ingest.ingest(body, request.headers.get("content-type", ""), current_user.username, chunk_size),
+        media_type="application/x-ndjson",
+    )
 
+@app.get("/reports/stats")
+async def get_report_stats(request: Request, current_user: UserInDB = Depends(get_current_user)):
+    return conditional_json(request, await report_stats.get_stats(current_user.username))
 
+@app.get("/reports")
+async def get_reports(request: Request, current_user: UserInDB = Depends(get_current_user)):
+    # Rename _id -> id server-side; the encoder stringifies the ObjectId
+    pipeline = [
+        {"$match": {"doctor_id": current_user.username}},
+        {"$limit": 100},
+        {"$addFields": {"id": "$_id"}},
+        {"$project": {"_id": 0}},
+    ]
+    reports = await db.reports.aggregate(pipeline).to_list(length=100)
+    return conditional_json(request, reports)
+
+
+
+
+@app.get("/reports/export")
+async def export_reports(
+    format: str = Query("zip", pattern="^(zip|pdf)$"),
+    doctor_name: Optional[str] = Query(None),
+    patient_id: Optional[str] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """
+    Streams the current doctor's reports matching the filter as a zip of PDFs
+    or one merged PDF, rendered in parallel and sent as they finish.
+    """
+    query = report_export.build_query(current_user.username, doctor_name, patient_id, start_date, end_date)
+    stamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+
+    cursor = db.reports.find(query).sort("created_at", 1)
+    if format == "pdf":
+        return StreamingResponse(
+            report_export.stream_merged_pdf(cursor),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f"attachment; filename=reports_{stamp}.pdf"},
+        )
+    return StreamingResponse(
+        report_export.stream_zip(cursor),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=reports_{stamp}.zip"},
+    )
 
 @app.get("/reports/{report_id}/download")
 async def download_report(report_id: str, current_user: UserInDB = Depends(get_current_user)):
@@ -445,6 +494,7 @@ async def download_report(report_id: str, current_user: UserInDB = Depends(get_c
 
         # Use helper function to generate PDF
         # Note: image_bytes is None here because we rely on placeholder logic for now
+        buffer = io.BytesIO()
         create_pdf_report(buffer, report)
         buffer.seek(0)
         
@@ -456,12 +506,13 @@ async def download_report(report_id: str, current_user: UserInDB = Depends(get_c
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Failed to generate PDF")
 
-@app.post("/segment")
-async def segment_fracture(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user)):
-    contents = await file.read()
-    
+def segment_image(contents, unet, yolo, detections=None):
+    """
+    Builds the /segment response for raw image bytes: U-Net if weights are
+    loaded, otherwise the YOLO + CV heuristic. Raises if the heuristic fails.
+    """
     # 1. Try U-Net first (if weights loaded)
-    if unet_model and unet_model.model_loaded:
+    if unet and unet.model.model_loaded:
         try:
             # Preprocess for U-Net
             pil_image = PIL.Image.open(io.BytesIO(contents)).convert("RGB")
@@ -474,7 +525,7 @@ async def segment_fracture(file: UploadFile = File(...), current_user: UserInDB
                 T.ToTensor(),
             ])
             input_tensor = transform(pil_image).unsqueeze(0)
-            mask = unet_model.predict(input_tensor)
+            mask = unet.model.predict(input_tensor)
             
             # Convert mask to base64 image
             mask_np = mask.squeeze().cpu().numpy()
@@ -490,93 +541,182 @@ async def segment_fracture(file: UploadFile = File(...), current_user: UserInDB
             mask_img.save(buffer, format="PNG")
             mask_b64 = base64.b64encode(buffer.getvalue()).decode()
             
-            return {"mask": f"data:image/png;base64,{mask_b64}", "method": "U-Net"}
+            return {"mask": f"data:image/png;base64,{mask_b64}", "method": "U-Net", "model_version": unet.version}
         except Exception as e:
             print(f"U-Net inference failed: {e}")
 
     # 2. Fallback: YOLO + CV Heuristic (Smart Segmentation)
     # This uses the YOLO bounding box to isolate the area, then uses edge detection/thresholding
     # to create a "tight" mask, simulating segmentation.
-    try:
-        pil_image = PIL.Image.open(io.BytesIO(contents)).convert("RGB")
-        import numpy as np
-        import cv2
-        open_cv_image = np.array(pil_image) 
-        # Convert RGB to BGR 
-        open_cv_image = open_cv_image[:, :, ::-1].copy()
-        
+    pil_image = PIL.Image.open(io.BytesIO(contents)).convert("RGB")
+    import numpy as np
+    import cv2
+    open_cv_image = np.array(pil_image) 
+    # Convert RGB to BGR 
+    open_cv_image = open_cv_image[:, :, ::-1].copy()
+
+    # Callers that already ran YOLO (e.g. /analyze/stream) pass their detections in
+    if detections is None:
         detections = []
-        if yolo_model:
-            detections = yolo_model.detect_fractures(pil_image)
-            
-        # Create a blank mask
-        mask = np.zeros(open_cv_image.shape[:2], dtype=np.uint8)
-        
-        has_detection = False
-        if detections:
-            for det in detections:
-                box = det['bbox'] # [x1, y1, x2, y2]
-                x1, y1, x2, y2 = map(int, box)
-                
-                # Extract ROI
-                roi = open_cv_image[y1:y2, x1:x2]
-                if roi.size == 0: continue
-                
-                # Processing ROI to find "fracture" features
-                gray_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-                # Invert (bones are white, fractures are dark lines)
-                # Adaptive Thresholding to find dark lines in bright bone
-                thresh_roi = cv2.adaptiveThreshold(gray_roi, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
-                
-                # Morphological operations to clean up noise
-                kernel = np.ones((3,3), np.uint8)
-                opening = cv2.morphologyEx(thresh_roi, cv2.MORPH_OPEN, kernel, iterations=1)
-                
-                # Place back into mask
-                mask[y1:y2, x1:x2] = opening
-                has_detection = True
-        
-        if not has_detection:
-            # If no YOLO detection, just return empty or simple Canny on whole image (too noisy usually)
-            pass
+        if yolo:
+            detections = yolo.model.detect_fractures(pil_image)
+
+    # Create a blank mask
+    mask = np.zeros(open_cv_image.shape[:2], dtype=np.uint8)
+
+    has_detection = False
+    if detections:
+        for det in detections:
+            box = det['bbox'] # [x1, y1, x2, y2]
+            x1, y1, x2, y2 = map(int, box)
+
+            # Extract ROI
+            roi = open_cv_image[y1:y2, x1:x2]
+            if roi.size == 0: continue
+
+            # Processing ROI to find "fracture" features
+            gray_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+            # Invert (bones are white, fractures are dark lines)
+            # Adaptive Thresholding to find dark lines in bright bone
+            thresh_roi = cv2.adaptiveThreshold(gray_roi, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
+
+            # Morphological operations to clean up noise
+            kernel = np.ones((3,3), np.uint8)
+            opening = cv2.morphologyEx(thresh_roi, cv2.MORPH_OPEN, kernel, iterations=1)
+
+            # Place back into mask
+            mask[y1:y2, x1:x2] = opening
+            has_detection = True
+
+    if not has_detection:
+        # If no YOLO detection, just return empty or simple Canny on whole image (too noisy usually)
+        pass
+
+    # Convert mask to base64
+    # Apply a red color to the mask
+    color_mask = np.zeros_like(open_cv_image)
+    color_mask[:, :] = [0, 0, 255] # Red in BGR
+
+    # We process 'mask' to be alpha channel
+    rgba_mask = np.dstack((color_mask, mask)) # BGR + Alpha
+    # Use simple PNG encoding
+
+    # Actually easier: Return just the raw mask, let frontend handle color? 
+    # Or return a transparent PNG with red pixels.
+
+    # Create PIL Image from mask
+    # Make a Red image
+    red_img = PIL.Image.new("RGBA", pil_image.size, (255, 0, 0, 0))
+    # Get data
+    datas = red_img.getdata()
+
+    # Efficient way:
+    # Create numpy array for RGBA
+    H, W = mask.shape
+    rgba = np.zeros((H, W, 4), dtype=np.uint8)
+    rgba[mask > 0] = [255, 0, 0, 128] # Red with 50% opacity
+
+    final_mask_img = PIL.Image.fromarray(rgba, 'RGBA')
 
-        # Convert mask to base64
-        # Apply a red color to the mask
-        color_mask = np.zeros_like(open_cv_image)
-        color_mask[:, :] = [0, 0, 255] # Red in BGR
-        
-        # We process 'mask' to be alpha channel
-        rgba_mask = np.dstack((color_mask, mask)) # BGR + Alpha
-        # Use simple PNG encoding
-        
-        # Actually easier: Return just the raw mask, let frontend handle color? 
-        # Or return a transparent PNG with red pixels.
-        
-        # Create PIL Image from mask
-        # Make a Red image
-        red_img = PIL.Image.new("RGBA", pil_image.size, (255, 0, 0, 0))
-        # Get data
-        datas = red_img.getdata()
-        
-        # Efficient way:
-        # Create numpy array for RGBA
-        H, W = mask.shape
-        rgba = np.zeros((H, W, 4), dtype=np.uint8)
-        rgba[mask > 0] = [255, 0, 0, 128] # Red with 50% opacity
-        
-        final_mask_img = PIL.Image.fromarray(rgba, 'RGBA')
-        
-        buffer = io.BytesIO()
-        final_mask_img.save(buffer, format="PNG")
-        import base64
-        mask_b64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        return {"mask": f"data:image/png;base64,{mask_b64}", "method": "YOLO+Heuristic", "detections": detections}
+    buffer = io.BytesIO()
+    final_mask_img.save(buffer, format="PNG")
+    mask_b64 = base64.b64encode(buffer.getvalue()).decode()
 
+    return {"mask": f"data:image/png;base64,{mask_b64}", "method": "YOLO+Heuristic", "detections": detections, "model_version": yolo.version if yolo else None}
+
+@app.post("/segment")
+async def segment_fracture(file: UploadFile = File(...), current_user: UserInDB = Depends(get_current_user), admitted: None = Depends(admission.admit("segment"))):
+    contents = await file.read()
+    unet = model_registry.get("unet")
+    yolo = model_registry.get("yolo")
+
+    try:
+        detections = None
+        if yolo:
+            pil_image, image_hash, thumb = await asyncio.to_thread(decode_and_fingerprint, contents)
+            detections = detection_cache.lookup(yolo, image_hash, thumb, pil_image.size)
+
+        result = await asyncio.to_thread(segment_image, contents, unet, yolo, detections)
+        if yolo and detections is None and "detections" in result:
+            detection_cache.store(yolo, image_hash, thumb, pil_image.size, result["detections"])
+        return FastJSONResponse(result)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Segmentation failed: {str(e)}")
 
+@app.get("/appointments/booked")
+async def get_booked_appointments(doctor_name: str = Query(...)):
+    # Only dates and times are exposed, so the booking page can call this without a token
+    return await appointments.upcoming_booked_slots(doctor_name)
+
+@app.post("/book_appointment", status_code=201)
+async def book_appointment(appointment: AppointmentCreate, current_user: UserInDB = Depends(get_current_user)):
+    try:
+        day = appointments.parse_date(appointment.appointment_date)
+        slot_time = appointments.parse_time(appointment.appointment_time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Expected appointment_date as YYYY-MM-DD and appointment_time as HH:MM")
+    if day < datetime.utcnow().date():
+        raise HTTPException(status_code=400, detail="Cannot book an appointment in the past")
+
+    try:
+        appointment_id = await appointments.book(current_user.username, appointment.doctor_name, day.isoformat(), slot_time)
+    except appointments.SlotTaken as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": "Appointment booked successfully", "id": appointment_id}
+
+@app.get("/admin/triage")
+async def get_triage_stats(admin: UserInDB = Depends(get_admin_user)):
+    return await triage.triage_stats(db)
+
+@app.get("/admin/models")
+async def list_models(admin: UserInDB = Depends(get_admin_user)):
+    return model_registry.list()
+
+@app.post("/admin/models/{kind}", status_code=202)
+async def upload_model_version(kind: str, version: str = Form(...), file: UploadFile = File(...), admin: UserInDB = Depends(get_admin_user)):
+    if kind not in MODEL_EXTENSIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown model kind: {kind}")
+    version = os.path.basename(version)
+    if not version or version in model_registry.versions[kind]:
+        raise HTTPException(status_code=400, detail=f"Invalid or existing {kind} version: {version}")
+
+    kind_dir = os.path.join(MODEL_DIR, kind)
+    os.makedirs(kind_dir, exist_ok=True)
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in MODEL_EXTENSIONS[kind]:
+        ext = MODEL_EXTENSIONS[kind][0]
+    path = os.path.join(kind_dir, version + ext)
+    with open(path, "wb") as f:
+        f.write(await file.read())
+    model_registry.register(kind, version, path)
+
+    # Load and warm up in the background; activation is a separate call
+    model_registry.load_in_background(kind, version)
+    return {"message": f"Loading {kind} version {version}", "kind": kind, "version": version}
+
+@app.post("/admin/models/{kind}/{version}/activate")
+async def activate_model_version(kind: str, version: str, admin: UserInDB = Depends(get_admin_user)):
+    if kind not in MODEL_EXTENSIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown model kind: {kind}")
+    try:
+        handle = await model_registry.activate(kind, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load {kind} version {version}: {e}")
+    return {"kind": kind, "active": handle.version}
+
+@app.post("/admin/models/{kind}/rollback")
+async def rollback_model_version(kind: str, admin: UserInDB = Depends(get_admin_user)):
+    if kind not in MODEL_EXTENSIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown model kind: {kind}")
+    try:
+        handle = await model_registry.rollback(kind)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"kind": kind, "active": handle.version}
+
 if __name__ == "__main__":
     uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True)
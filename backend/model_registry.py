@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+import PIL.Image
+
+from .yolo_model import YoloModel
+from .unet_model import UNetInference, OnnxUNetInference
+
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+ACTIVE_FILE = os.path.join(MODEL_DIR, "active.json")
+WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "5"))
+# Prefer the "<version>-int8" build of each model when one has passed its accuracy gate
+QUANTIZED_INFERENCE = os.getenv("QUANTIZED_INFERENCE", "0").lower() in ("1", "true", "yes")
+
+# Version files live under models/<kind>/<version><ext>; the first extension is the native one
+MODEL_EXTENSIONS = {
+    "yolo": (".pt", ".onnx"),
+    "unet": (".pth", ".onnx"),
+}
+
+
+def gate_path(model_path):
+    """Accuracy report written by backend.quantize next to every INT8 model."""
+    return os.path.splitext(model_path)[0] + ".gate.json"
+
+
+def read_gate(model_path):
+    path = gate_path(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class ModelHandle:
+    """A loaded, warmed-up model together with the version it was loaded from."""
+    def __init__(self, kind, version, path, model):
+        self.kind = kind
+        self.version = version
+        self.path = path
+        self.model = model
+        self.loaded_at = time.time()
+
+    def cache_key(self, digest):
+        """Namespaces a content digest so cached results never cross model versions."""
+        return f"{self.kind}:{self.version}:{digest}"
+
+
+def _build_model(kind, path):
+    if kind == "yolo":
+        model = YoloModel(path) if path else YoloModel()
+        model.warm_up(PIL.Image.fromarray(np.zeros((640, 640, 3), dtype=np.uint8)))
+        return model
+    if kind == "unet":
+        if path and path.endswith(".onnx"):
+            model = OnnxUNetInference(path)
+        else:
+            model = UNetInference(model_path=path)
+        if model.model_loaded:
+            import torch
+            model.predict(torch.zeros(1, 3, 256, 256))
+        return model
+    raise ValueError(f"Unknown model kind: {kind}")
+
+
+class ModelRegistry:
+    """
+    Keeps the known versions of each model kind and the one currently serving.
+    New versions are loaded and warmed up in a worker thread, then swapped in
+    with a single reference assignment. Requests hold on to the handle they
+    started with, so in-flight work finishes on the old version.
+    """
+    def __init__(self):
+        self.versions = {kind: {} for kind in MODEL_EXTENSIONS}
+        self.loaded = {kind: {} for kind in MODEL_EXTENSIONS}
+        self.active = {kind: None for kind in MODEL_EXTENSIONS}
+        self.history = {kind: [] for kind in MODEL_EXTENSIONS}
+        self.loading = {kind: set() for kind in MODEL_EXTENSIONS}
+        self._lock = asyncio.Lock()
+        self._active_mtime = None
+        self._tasks = set()
+
+    def register(self, kind, version, path):
+        if kind not in self.versions:
+            raise ValueError(f"Unknown model kind: {kind}")
+        self.versions[kind][version] = path
+
+    def discover(self):
+        """Registers every weights file found under MODEL_DIR."""
+        for kind, extensions in MODEL_EXTENSIONS.items():
+            kind_dir = os.path.join(MODEL_DIR, kind)
+            if not os.path.isdir(kind_dir):
+                continue
+            for name in sorted(os.listdir(kind_dir)):
+                stem, ext = os.path.splitext(name)
+                if ext in extensions:
+                    self.register(kind, stem, os.path.join(kind_dir, name))
+
+    def get(self, kind):
+        """Returns the active ModelHandle for `kind`, or None if nothing is loaded."""
+        return self.active.get(kind)
+
+    def list(self):
+        result = {}
+        for kind, versions in self.versions.items():
+            active = self.active[kind]
+            result[kind] = {
+                "active": active.version if active else None,
+                "versions": [
+                    {
+                        "version": version,
+                        "path": path,
+                        "loaded": version in self.loaded[kind],
+                        "loading": version in self.loading[kind],
+                    }
+                    for version, path in versions.items()
+                ],
+                "history": list(self.history[kind]),
+            }
+        return result
+
+    async def load(self, kind, version):
+        """Loads and warms up a version without activating it."""
+        if version in self.loaded[kind]:
+            return self.loaded[kind][version]
+        if version not in self.versions[kind]:
+            raise KeyError(f"Unknown {kind} version: {version}")
+
+        path = self.versions[kind][version]
+        if path and not os.path.exists(path) and version != "default":
+            raise FileNotFoundError(path)
+        if path and path.endswith(".onnx"):
+            # Quantized builds may only serve once they have passed the accuracy check
+            gate = read_gate(path)
+            if gate is None and version.endswith("-int8"):
+                raise ValueError(f"{kind} version {version} has no accuracy gate report")
+            if gate is not None and not gate.get("passed"):
+                raise ValueError(
+                    f"{kind} version {version} failed its accuracy gate "
+                    f"({gate['metric']} drop {gate['drop']:.4f} > tolerance {gate['tolerance']})"
+                )
+
+        self.loading[kind].add(version)
+        try:
+            model = await asyncio.to_thread(_build_model, kind, path)
+        finally:
+            self.loading[kind].discard(version)
+
+        handle = ModelHandle(kind, version, path, model)
+        self.loaded[kind][version] = handle
+        print(f"Loaded {kind} model version {version}")
+        return handle
+
+    def load_in_background(self, kind, version):
+        task = asyncio.create_task(self.load(kind, version))
+        # Keep a reference until done so the task isn't garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+        return task
+
+    def _on_background_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"Background model load failed: {task.exception()}")
+
+    async def activate(self, kind, version, persist=True):
+        async with self._lock:
+            handle = await self.load(kind, version)
+            previous = self.active[kind]
+            if previous is handle:
+                return handle
+            if previous is not None:
+                self.history[kind].append(previous.version)
+            self.active[kind] = handle
+            self._evict(kind)
+            print(f"Activated {kind} model version {version}")
+            if persist:
+                self._write_active()
+            return handle
+
+    async def rollback(self, kind):
+        async with self._lock:
+            if not self.history[kind]:
+                raise ValueError(f"No previous {kind} version to roll back to")
+            version = self.history[kind].pop()
+            handle = await self.load(kind, version)
+            self.active[kind] = handle
+            self._evict(kind)
+            print(f"Rolled back {kind} model to version {version}")
+            self._write_active()
+            return handle
+
+    def _evict(self, kind):
+        # Keep the active version and the rollback target warm, drop the rest
+        keep = {self.active[kind].version}
+        if self.history[kind]:
+            keep.add(self.history[kind][-1])
+        for version in list(self.loaded[kind]):
+            if version not in keep:
+                del self.loaded[kind][version]
+
+    def _write_active(self):
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        state = {kind: handle.version for kind, handle in self.active.items() if handle}
+        tmp_path = ACTIVE_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, ACTIVE_FILE)
+        self._active_mtime = os.path.getmtime(ACTIVE_FILE)
+
+    def _read_active(self):
+        if not os.path.exists(ACTIVE_FILE):
+            return {}
+        with open(ACTIVE_FILE, "r") as f:
+            return json.load(f)
+
+    async def start(self):
+        """Loads the persisted (or default) versions at startup."""
+        self.discover()
+        state = self._read_active()
+        for kind in MODEL_EXTENSIONS:
+            version = state.get(kind, "default")
+            if version not in self.versions[kind]:
+                version = "default"
+            if QUANTIZED_INFERENCE and f"{version}-int8" in self.versions[kind]:
+                try:
+                    await self.activate(kind, f"{version}-int8", persist=False)
+                    continue
+                except Exception as e:
+                    print(f"Quantized {kind} model unavailable, using float version {version}: {e}")
+            try:
+                await self.activate(kind, version, persist=False)
+            except Exception as e:
+                print(f"Failed to load {kind} model version {version}: {e}")
+        if os.path.exists(ACTIVE_FILE):
+            self._active_mtime = os.path.getmtime(ACTIVE_FILE)
+
+    async def watch(self):
+        """
+        Follows activations made by other uvicorn workers through active.json,
+        so one admin call switches every worker without a restart.
+        """
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            try:
+                if not os.path.exists(ACTIVE_FILE):
+                    continue
+                mtime = os.path.getmtime(ACTIVE_FILE)
+                if mtime == self._active_mtime:
+                    continue
+                self._active_mtime = mtime
+                self.discover()
+                for kind, version in self._read_active().items():
+                    current = self.active.get(kind)
+                    if version in self.versions.get(kind, {}) and (current is None or current.version != version):
+                        await self.activate(kind, version, persist=False)
+            except Exception as e:
+                print(f"Model watcher error: {e}")
+
+
+model_registry = ModelRegistry()
+model_registry.register("yolo", "default", "best.pt")
+model_registry.register("unet", "default", "unet_fracture.pth" if os.path.exists("unet_fracture.pth") else None)
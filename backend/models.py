@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Union
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -10,6 +10,7 @@ class UserCreate(UserBase):
     password: str
 
 class UserInDB(UserBase):
+    id: Optional[str] = None
     hashed_password: str
 
 class User(UserBase):
@@ -34,11 +35,17 @@ class ReportBase(BaseModel):
     doctor_name: Optional[str] = None # Override doctor name for report
 
 class ReportCreate(ReportBase):
-    pass
+    detailed_analysis: Optional[str] = None
+    recommendations: Optional[Union[List[str], str]] = None
+    is_annotated_image: bool = False
+    created_at: Optional[datetime] = None # Original study date when ingesting history
 
 class Report(ReportBase):
     id: str
     created_at: datetime
     doctor_id: str
 
-
+class AppointmentCreate(BaseModel):
+    doctor_name: str
+    appointment_date: str # YYYY-MM-DD
+    appointment_time: str # HH:MM
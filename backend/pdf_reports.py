@@ -0,0 +1,205 @@
+import io
+from datetime import datetime
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+STATIC_FORM = "report_static"
+
+
+def define_static_form(c):
+    """
+    Draws the parts of a report page that never change (header, rule,
+    disclaimer footer) once into a reusable form XObject. Each page then
+    references it with doForm instead of redrawing it.
+    """
+    width, height = letter
+    c.beginForm(STATIC_FORM)
+    # Header
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, height - 50, "OrthoAI Diagnostic Report")
+    
+    c.setFont("Helvetica", 12)
+    c.drawString(50, height - 80, "Generated by AI Analysis System")
+    c.line(50, height - 90, width - 50, height - 90)
+
+    # Footer
+    c.setFont("Helvetica-Oblique", 10)
+    c.drawString(50, 50, "Disclaimer: This report is generated by AI and should be verified by a medical professional.")
+    c.endForm()
+
+
+def draw_report_page(c, data, image_bytes=None):
+    """Draws one report onto the current page of `c` (define_static_form must have run)."""
+    width, height = letter
+    c.doForm(STATIC_FORM)
+    c.setFont("Helvetica", 12)
+    
+    # Patient/Doctor Info
+    doctor_name = data.get("doctor_name") or data.get("doctor_id") or "Unknown"
+    c.drawString(50, height - 120, f"Doctor: {doctor_name}")
+    c.drawString(50, height - 140, f"Patient ID: {data.get('patient_id', 'Unknown')}")
+    created_at = data.get("created_at", datetime.now())
+    if isinstance(created_at, str):
+         # Try parsing if string
+         try: created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+         except: pass
+    date_str = created_at.strftime('%Y-%m-%d') if isinstance(created_at, datetime) else str(created_at)
+    c.drawString(300, height - 120, f"Date: {date_str}")
+    
+    # Patient Image
+    img_y_bottom = height - 400
+    img_display_h = 250
+    img_display_w = 250
+    img_x_left = 50
+    
+    if image_bytes:
+        try:
+            img = ImageReader(io.BytesIO(image_bytes))
+            orig_w, orig_h = img.getSize()
+            aspect = orig_w / orig_h
+            
+            # Calculate scale to fit in 250x250
+            scale = min(img_display_w / orig_w, img_display_h / orig_h)
+            drawn_w = orig_w * scale
+            drawn_h = orig_h * scale
+            
+            # Center the image in the box
+            offset_x = (img_display_w - drawn_w) / 2
+            offset_y = (img_display_h - drawn_h) / 2
+            final_x = img_x_left + offset_x
+            final_y = img_y_bottom + offset_y
+            
+            c.drawImage(img, final_x, final_y, width=drawn_w, height=drawn_h)
+            
+            # Draw Bounding Box if exists AND not using an already annotated image
+            if not data.get("is_annotated_image"):
+                damage_loc = data.get("damage_location")
+                if damage_loc and isinstance(damage_loc, dict):
+                    x = float(damage_loc.get("x", 0))
+                    y = float(damage_loc.get("y", 0))
+                    w = float(damage_loc.get("width", 0))
+                    h = float(damage_loc.get("height", 0))
+                    
+                    # Check for normalized coordinates (usually < 1)
+                    # If they are not normalized, we assume they are percentages anyway based on Gemini prompt
+                    
+                    # Calculate PDF coordinates
+                    # Image/Canvas origin is Top-Left. PDF origin is Bottom-Left.
+                    # Box X (from left of image) = x * drawn_w
+                    # Box Y (from TOP of image) = y * drawn_h
+                    
+                    rect_x = final_x + (x * drawn_w)
+                    rect_y_top = final_y + drawn_h - (y * drawn_h)
+                    rect_y_bottom = rect_y_top - (h * drawn_h)
+                    
+                    # Make circle instead of ellipse
+                    # Use max dimension for radius to cover area
+                    orig_w_px = w * drawn_w
+                    orig_h_px = h * drawn_h
+                    max_dim = max(orig_w_px, orig_h_px)
+                    
+                    diameter = max_dim * 1.2
+                    radius = diameter / 2
+                    
+                    # Center of original box
+                    center_x = rect_x + (orig_w_px / 2)
+                    center_y_abs = rect_y_top - (orig_h_px / 2) # Y grows UP in PDF from bottom
+                    
+                    c.setStrokeColorRGB(1, 0, 0) # Red
+                    c.setLineWidth(3)
+                    
+                    # c.circle(x_cen, y_cen, radius, stroke=1, fill=0)
+                    c.circle(center_x, center_y_abs, radius, stroke=1, fill=0)
+                    
+                    c.setStrokeColorRGB(0, 0, 0) # Reset to black
+                
+        except Exception as e:
+            print(f"Error drawing image: {e}")
+            c.drawString(50, height - 200, "Image could not be processed")
+    else:
+        c.drawString(50, height - 300, "[Image Placeholder - Image not stored in DB]")
+    
+    # Results Summary
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(350, height - 180, "Analysis Summary")
+    
+    c.setFont("Helvetica", 12)
+    c.drawString(350, height - 210, f"Disorder: {data.get('disorder', 'N/A')}")
+    c.drawString(350, height - 230, f"Confidence: {float(data.get('confidence', 0))*100:.1f}%")
+    c.drawString(350, height - 250, f"Severity: {data.get('severity', 'N/A')}")
+    
+    # Detailed Analysis
+    y_position = height - 450
+    if data.get('detailed_analysis'):
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(50, y_position, "Detailed Analysis")
+        y_position -= 20
+        c.setFont("Helvetica", 11)
+        
+        analysis_lines = []
+        current_line = ""
+        words = (data.get('detailed_analysis') or "").split()
+        for word in words:
+            if c.stringWidth(current_line + " " + word, "Helvetica", 11) < 500:
+                current_line += " " + word
+            else:
+                analysis_lines.append(current_line)
+                current_line = word
+        analysis_lines.append(current_line)
+        
+        for line in analysis_lines:
+            c.drawString(50, y_position, line)
+            y_position -= 15
+        y_position -= 10
+
+    # Recommendations
+    if data.get('recommendations'):
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(50, y_position, "Recommendations")
+        y_position -= 20
+        c.setFont("Helvetica", 11)
+        
+        rec_lines = (data.get('recommendations') or "").split('\n')
+        for line in rec_lines:
+            c.drawString(50, y_position, line)
+            y_position -= 15
+        y_position -= 10
+
+    # Clinical Notes
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y_position, "Clinical Notes")
+    y_position -= 20
+    c.setFont("Helvetica", 11)
+    c.drawString(50, y_position, data.get('notes', ''))
+
+
+def create_pdf_report(buffer, data, image_bytes=None):
+    c = canvas.Canvas(buffer, pagesize=letter)
+    define_static_form(c)
+    draw_report_page(c, data, image_bytes)
+    c.save()
+
+
+def render_report_pdf(data, image_bytes=None):
+    """Renders a single report to PDF bytes. Top-level so worker processes can run it."""
+    buffer = io.BytesIO()
+    create_pdf_report(buffer, data, image_bytes)
+    return buffer.getvalue()
+
+
+def render_merged_pdf(buffer, reports):
+    """Renders many reports into one PDF, one page each, sharing a single static form."""
+    c = canvas.Canvas(buffer, pagesize=letter)
+    define_static_form(c)
+    for data in reports:
+        draw_report_page(c, data)
+        c.showPage()
+    c.save()
+
+
+def render_merged_pdf_bytes(reports):
+    buffer = io.BytesIO()
+    render_merged_pdf(buffer, reports)
+    return buffer.getvalue()
@@ -0,0 +1,194 @@
+import os
+import threading
+from collections import OrderedDict
+from itertools import combinations
+
+import cv2
+import numpy as np
+
+PHASH_RADIUS = int(os.getenv("PHASH_RADIUS", "4"))
+PHASH_MAX_ENTRIES = int(os.getenv("PHASH_MAX_ENTRIES", "100000"))
+# Hash matches are only candidates; the stored thumbnail must also correlate this well.
+# Re-encoded/resized copies of a film score >= 0.99, different films that collide on
+# the hash scored 0.65-0.73 on BoneFractureYolo8/train
+PHASH_MIN_CORRELATION = float(os.getenv("PHASH_MIN_CORRELATION", "0.97"))
+# Near-identical films keep their shape; reject matches whose aspect ratio moved more than this
+MAX_ASPECT_DRIFT = 0.05
+
+HASH_BITS = 63
+THUMB_SIZE = 32
+
+
+def _gray(image):
+    arr = np.asarray(image)
+    if arr.ndim == 3:
+        arr = cv2.cvtColor(np.ascontiguousarray(arr[:, :, :3]), cv2.COLOR_RGB2GRAY)
+    return arr
+
+
+def _hash_gray(gray):
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    # The DC term is above the median on every film, so it carries no information
+    low = cv2.dct(small)[:8, :8].flatten()[1:]
+    bits = low > np.median(low)
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(image):
+    """
+    63-bit DCT perceptual hash of a PIL image or RGB/grayscale numpy array.
+    Robust to re-encoding, resizing and mild contrast changes.
+    """
+    return _hash_gray(_gray(image))
+
+
+def fingerprint(image):
+    """Returns (phash, thumbnail): the hash finds candidates, the thumbnail verifies them."""
+    gray = _gray(image)
+    thumb = cv2.resize(gray, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    return _hash_gray(gray), thumb
+
+
+def similarity(a, b):
+    """Pearson correlation of two thumbnails; insensitive to brightness and contrast shifts."""
+    a = a.astype(np.float32).ravel()
+    b = b.astype(np.float32).ravel()
+    a -= a.mean()
+    b -= b.mean()
+    denom = float(np.sqrt((a * a).sum() * (b * b).sum()))
+    if denom == 0:
+        return 1.0 if not a.any() and not b.any() else 0.0
+    return float((a * b).sum()) / denom
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class PHashIndex:
+    """
+    Multi-index hashing over 63-bit hashes. The hash is split into `chunks`
+    disjoint chunks; by the pigeonhole principle any hash within `radius`
+    bits is within radius // chunks bits of the query on at least one
+    chunk, so a lookup probes those few keys per chunk and only verifies
+    the candidates found there.
+
+    Bits are dealt to chunks round-robin rather than in contiguous runs:
+    neighbouring DCT coefficients are correlated on radiographs, and
+    contiguous chunks leave most buckets empty and a few very full.
+    Three 21-bit chunks keep buckets small into the millions of entries.
+    """
+    def __init__(self, radius=PHASH_RADIUS, max_entries=PHASH_MAX_ENTRIES, chunks=3, bits=HASH_BITS):
+        self.radius = radius
+        self.max_entries = max_entries
+        self.chunk_radius = radius // chunks
+        self.positions = [list(range(i, bits, chunks)) for i in range(chunks)]
+        self.probes = [
+            [sum(1 << i for i in flips) for r in range(self.chunk_radius + 1) for flips in combinations(range(len(pos)), r)]
+            for pos in self.positions
+        ]
+        self.tables = [{} for _ in self.positions]
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _chunks(self, value):
+        keys = []
+        for pos in self.positions:
+            key = 0
+            for i, p in enumerate(pos):
+                key |= ((value >> p) & 1) << i
+            keys.append(key)
+        return keys
+
+    def add(self, value, payload):
+        with self._lock:
+            if value in self.entries:
+                self.entries.move_to_end(value)
+            else:
+                for table, chunk in zip(self.tables, self._chunks(value)):
+                    table.setdefault(chunk, set()).add(value)
+            self.entries[value] = payload
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, value):
+        del self.entries[value]
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[chunk]
+
+    def search(self, value, radius=None):
+        """Returns [(distance, payload)] within `radius` bits, nearest first."""
+        radius = self.radius if radius is None else min(radius, self.radius)
+        with self._lock:
+            seen = set()
+            matches = []
+            for table, chunk, probes in zip(self.tables, self._chunks(value), self.probes):
+                for flip in probes:
+                    for candidate in table.get(chunk ^ flip, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        distance = hamming(value, candidate)
+                        if distance <= radius:
+                            matches.append((distance, self.entries[candidate]))
+            matches.sort(key=lambda m: m[0])
+            return matches
+
+
+def rescale_detections(detections, from_size, to_size):
+    """Maps pixel bboxes stored for an image of `from_size` onto one of `to_size`."""
+    sx = to_size[0] / from_size[0]
+    sy = to_size[1] / from_size[1]
+    rescaled = []
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        rescaled.append({**det, "bbox": [x1 * sx, y1 * sy, x2 * sx, y2 * sy]})
+    return rescaled
+
+
+class DetectionCache:
+    """
+    Previously computed detections, looked up by perceptual hash, one index
+    per model version. A hash match is only reused when the stored
+    thumbnail also correlates with the new image, so two different films
+    that happen to collide on the hash never share detections.
+    """
+    def __init__(self, radius=PHASH_RADIUS, max_entries=PHASH_MAX_ENTRIES, min_correlation=PHASH_MIN_CORRELATION):
+        self.radius = radius
+        self.max_entries = max_entries
+        self.min_correlation = min_correlation
+        self._indexes = {}
+
+    def _index(self, handle):
+        namespace = handle.cache_key("phash")
+        index = self._indexes.get(namespace)
+        if index is None:
+            index = self._indexes.setdefault(namespace, PHashIndex(self.radius, self.max_entries))
+        return index
+
+    def lookup(self, handle, value, thumb, size):
+        """Returns detections rescaled to `size` for the nearest verified match, or None."""
+        width, height = size
+        for _, (stored_size, stored_thumb, detections) in self._index(handle).search(value):
+            stored_aspect = stored_size[0] / stored_size[1]
+            if abs(stored_aspect - width / height) / stored_aspect > MAX_ASPECT_DRIFT:
+                continue
+            if similarity(thumb, stored_thumb) >= self.min_correlation:
+                return rescale_detections(detections, stored_size, size)
+        return None
+
+    def store(self, handle, value, thumb, size, detections):
+        self._index(handle).add(value, (tuple(size), thumb, detections))
+
+
+detection_cache = DetectionCache()
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import random
+import shutil
+
+import cv2
+import numpy as np
+import PIL.Image
+import torch
+
+from .dataset_packer import list_split, load_sample, read_yolo_labels
+from .model_registry import MODEL_DIR, gate_path
+from .unet_model import UNet, OnnxUNetInference
+from .yolo_model import YoloModel
+
+DEFAULT_DATASET = "BoneFractureYolo8"
+UNET_SIZE = 256
+YOLO_SIZE = 640
+
+
+def letterbox(img, size=YOLO_SIZE):
+    """Resizes keeping aspect ratio and pads with grey, as ultralytics does."""
+    h, w = img.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top = (size - new_h) // 2
+    left = (size - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return canvas
+
+
+def sample_images(dataset_root, split, count, seed=0):
+    pairs = list_split(dataset_root, split)
+    random.Random(seed).shuffle(pairs)
+    return pairs[:count]
+
+
+class ImageCalibrationReader:
+    """Feeds calibration batches to onnxruntime's quantize_static."""
+    def __init__(self, input_name, image_paths, preprocess):
+        self.input_name = input_name
+        self.image_paths = image_paths
+        self.preprocess = preprocess
+        self._iter = iter(self.image_paths)
+
+    def get_next(self):
+        for path in self._iter:
+            batch = self.preprocess(path)
+            if batch is not None:
+                return {self.input_name: batch}
+        return None
+
+    def rewind(self):
+        self._iter = iter(self.image_paths)
+
+
+def _unet_input(path):
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, (UNET_SIZE, UNET_SIZE), interpolation=cv2.INTER_AREA)
+    return (img.transpose(2, 0, 1)[None].astype(np.float32) / 255.0)
+
+
+def _yolo_input(path):
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = letterbox(img)
+    return (img.transpose(2, 0, 1)[None].astype(np.float32) / 255.0)
+
+
+def quantize_onnx(float_path, int8_path, image_paths, preprocess):
+    """Static INT8 (QDQ) quantization calibrated on `image_paths`."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(float_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class Reader(ImageCalibrationReader, CalibrationDataReader):
+        pass
+
+    quantize_static(
+        float_path,
+        int8_path,
+        Reader(input_name, image_paths, preprocess),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+
+# ---- Accuracy metrics ----
+
+def box_iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def average_precision(recall, precision):
+    """All-point interpolated AP (VOC 2010+/COCO style)."""
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[1.0], precision, [0.0]])
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    idx = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[idx + 1] - recall[idx]) * precision[idx + 1]))
+
+
+def map50(predictions, ground_truths):
+    """
+    mAP@0.5 over classes that appear in the ground truth.
+    predictions: per image, list of (class_id, confidence, [x1, y1, x2, y2])
+    ground_truths: per image, list of (class_id, [x1, y1, x2, y2])
+    """
+    classes = {cls for gts in ground_truths for cls, _ in gts}
+    aps = []
+    for cls in classes:
+        scored = []
+        n_gt = 0
+        for preds, gts in zip(predictions, ground_truths):
+            gt_boxes = np.array([box for c, box in gts if c == cls], dtype=np.float32).reshape(-1, 4)
+            n_gt += len(gt_boxes)
+            matched = np.zeros(len(gt_boxes), dtype=bool)
+            for _, conf, box in sorted((p for p in preds if p[0] == cls), key=lambda p: -p[1]):
+                hit = False
+                if len(gt_boxes):
+                    ious = box_iou(np.array(box, dtype=np.float32), gt_boxes)
+                    best = int(np.argmax(ious))
+                    if ious[best] >= 0.5 and not matched[best]:
+                        matched[best] = True
+                        hit = True
+                scored.append((conf, hit))
+        if n_gt == 0:
+            continue
+        scored.sort(key=lambda s: -s[0])
+        hits = np.array([h for _, h in scored], dtype=np.float32)
+        tp = np.cumsum(hits)
+        fp = np.cumsum(1 - hits)
+        recall = tp / n_gt
+        precision = tp / np.maximum(tp + fp, 1e-9)
+        aps.append(average_precision(recall, precision))
+    return float(np.mean(aps)) if aps else 0.0
+
+
+def yolo_ground_truth(image_path, label_path):
+    """Converts polygon/box labels into pixel xyxy boxes for an image."""
+    with PIL.Image.open(image_path) as img:
+        w, h = img.size
+    boxes = []
+    for cls, points in read_yolo_labels(label_path):
+        x1, y1 = points.min(axis=0)
+        x2, y2 = points.max(axis=0)
+        boxes.append((cls, [x1 * w, y1 * h, x2 * w, y2 * h]))
+    return boxes
+
+
+def evaluate_yolo(model, pairs):
+    predictions = []
+    ground_truths = []
+    for image_path, label_path in pairs:
+        with PIL.Image.open(image_path) as img:
+            detections = model.detect_fractures(img.convert("RGB"))
+        predictions.append([(d["class_id"], d["confidence"], d["bbox"]) for d in detections])
+        ground_truths.append(yolo_ground_truth(image_path, label_path))
+    return map50(predictions, ground_truths)
+
+
+def evaluate_unet(predict, pairs):
+    """Pooled mask IoU, same definition as train_unet.evaluate."""
+    intersection = 0.0
+    union = 0.0
+    for image_path, label_path in pairs:
+        sample = load_sample((image_path, label_path, UNET_SIZE))
+        if sample is None:
+            continue
+        img, gt, _ = sample
+        tensor = torch.from_numpy(img.transpose(2, 0, 1).copy()).float().div_(255.0).unsqueeze(0)
+        pred = predict(tensor).squeeze().numpy() > 0.5
+        gt = gt > 0
+        intersection += np.logical_and(pred, gt).sum()
+        union += np.logical_or(pred, gt).sum()
+    return float(intersection / union) if union > 0 else 1.0
+
+
+# ---- Pipelines ----
+
+def quantize_unet(weights, out_dir, version, dataset_root, calib_samples, tolerance):
+    os.makedirs(out_dir, exist_ok=True)
+    float_onnx = os.path.join(out_dir, f"{version}-fp32.onnx.tmp")
+    int8_path = os.path.join(out_dir, f"{version}-int8.onnx")
+
+    model = UNet(n_channels=3, n_classes=1)
+    model.load_state_dict(torch.load(weights, map_location="cpu"))
+    model.eval()
+    torch.onnx.export(
+        model,
+        torch.zeros(1, 3, UNET_SIZE, UNET_SIZE),
+        float_onnx,
+        input_names=["images"],
+        output_names=["logits"],
+        dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=13,
+    )
+
+    calib = [img for img, _ in sample_images(dataset_root, "train", calib_samples)]
+    quantize_onnx(float_onnx, int8_path, calib, _unet_input)
+    os.remove(float_onnx)
+
+    val_pairs = list_split(dataset_root, "valid")
+
+    def float_predict(tensor):
+        with torch.no_grad():
+            return (torch.sigmoid(model(tensor)) > 0.5).float()
+
+    float_iou = evaluate_unet(float_predict, val_pairs)
+    quant_iou = evaluate_unet(OnnxUNetInference(int8_path).predict, val_pairs)
+    return write_gate(int8_path, "mask_iou", float_iou, quant_iou, tolerance)
+
+
+def quantize_yolo(weights, out_dir, version, dataset_root, calib_samples, tolerance):
+    from ultralytics import YOLO
+
+    os.makedirs(out_dir, exist_ok=True)
+    int8_path = os.path.join(out_dir, f"{version}-int8.onnx")
+
+    exported = YOLO(weights).export(format="onnx", imgsz=YOLO_SIZE, dynamic=False, simplify=True)
+    float_onnx = os.path.join(out_dir, f"{version}-fp32.onnx.tmp")
+    shutil.move(exported, float_onnx)
+
+    calib = [img for img, _ in sample_images(dataset_root, "train", calib_samples)]
+    quantize_onnx(float_onnx, int8_path, calib, _yolo_input)
+    os.remove(float_onnx)
+
+    val_pairs = list_split(dataset_root, "valid")
+    # Evaluation is sequential, so one instance each is enough
+    float_map = evaluate_yolo(YoloModel(weights, replicas=1), val_pairs)
+    quant_map = evaluate_yolo(YoloModel(int8_path, replicas=1), val_pairs)
+    return write_gate(int8_path, "map50", float_map, quant_map, tolerance)
+
+
+def write_gate(model_path, metric, float_value, quant_value, tolerance):
+    drop = float_value - quant_value
+    report = {
+        "metric": metric,
+        "float": float_value,
+        "quantized": quant_value,
+        "drop": drop,
+        "tolerance": tolerance,
+        "passed": drop <= tolerance,
+    }
+    with open(gate_path(model_path), "w") as f:
+        json.dump(report, f, indent=2)
+
+    status = "PASSED" if report["passed"] else "FAILED"
+    print(f"Accuracy gate {status}: {metric} float={float_value:.4f} int8={quant_value:.4f} drop={drop:.4f} (tolerance {tolerance})")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build INT8 ONNX models for CPU inference, gated on validation accuracy.")
+    parser.add_argument("--kind", choices=["yolo", "unet"], required=True)
+    parser.add_argument("--weights", default=None, help="Float weights (defaults to best.pt / unet_fracture.pth)")
+    parser.add_argument("--version", default="default", help="Registry version the INT8 model derives from")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--calib-samples", type=int, default=200)
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("QUANT_TOLERANCE", "0.02")),
+                        help="Maximum allowed absolute drop in mAP@0.5 / mask IoU")
+    args = parser.parse_args()
+
+    out_dir = os.path.join(MODEL_DIR, args.kind)
+    if args.kind == "yolo":
+        weights = args.weights or "best.pt"
+        report = quantize_yolo(weights, out_dir, args.version, args.dataset, args.calib_samples, args.tolerance)
+    else:
+        weights = args.weights or "unet_fracture.pth"
+        report = quantize_unet(weights, out_dir, args.version, args.dataset, args.calib_samples, args.tolerance)
+
+    if not report["passed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
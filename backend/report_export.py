@@ -0,0 +1,221 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from .pdf_reports import render_report_pdf, render_merged_pdf_bytes
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# Reports per render task in a merged PDF; each batch gets its own static form
+MERGE_BATCH_SIZE = int(os.getenv("EXPORT_MERGE_BATCH", "16"))
+
+_executor = None
+
+
+def get_executor():
+    """Process pool for PDF rendering (reportlab is pure Python, so threads would serialize on the GIL)."""
+    global _executor
+    if _executor is None:
+        # spawn: don't fork a server process that has model threads running
+        _executor = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def build_query(doctor_id, doctor_name=None, patient_id=None, start_date=None, end_date=None):
+    query = {"doctor_id": doctor_id}
+    if doctor_name:
+        query["doctor_name"] = doctor_name
+    if patient_id:
+        query["patient_id"] = patient_id
+    if start_date or end_date:
+        query["created_at"] = {}
+        if start_date:
+            query["created_at"]["$gte"] = start_date
+        if end_date:
+            query["created_at"]["$lte"] = end_date
+    return query
+
+
+def report_filename(report):
+    created_at = report.get("created_at")
+    date_str = created_at.strftime("%Y%m%d") if isinstance(created_at, datetime) else "undated"
+    patient = re.sub(r"[^A-Za-z0-9_-]+", "_", str(report.get("patient_id") or "unknown"))
+    return f"report_{patient}_{date_str}_{report['_id']}.pdf"
+
+
+class _StreamSink:
+    """Write-only file object; zipfile falls back to streaming mode when it cannot seek."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_zip(cursor):
+    """
+    Yields a zip archive of one PDF per report. At most 2 * EXPORT_WORKERS
+    reports are rendering or buffered at any time, and finished entries are
+    sent to the client in cursor order.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    window = EXPORT_WORKERS * 2
+    pending = deque()
+    sink = _StreamSink()
+    # PDFs are already deflate-compressed internally
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)
+
+    async def write_oldest():
+        name, future = pending.popleft()
+        archive.writestr(name, await future)
+        return sink.drain()
+
+    try:
+        async for report in cursor:
+            pending.append((report_filename(report), loop.run_in_executor(executor, render_report_pdf, report)))
+            if len(pending) >= window:
+                yield await write_oldest()
+        while pending:
+            yield await write_oldest()
+        archive.close()
+        yield sink.drain()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+class _MergedPdfWriter:
+    """
+    Writes one PDF incrementally out of per-batch PDFs. Each batch's pages
+    and everything they reference are renumbered after the objects already
+    sent and written out straight away; the page tree, catalog and xref
+    table follow the last batch, so only their offsets are kept in memory.
+    """
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.kids = []
+        self.next_id = 3
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _write_object(self, out, idnum, obj):
+        self.offsets[idnum] = self.offset + out.tell()
+        out.write(f"{idnum} 0 obj\n".encode())
+        obj.write_to_stream(out)
+        out.write(b"\nendobj\n")
+
+    def header(self):
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def add_batch(self, pdf_bytes):
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        numbers = {}
+        objects = []
+
+        def renumber(ref):
+            if ref.idnum not in numbers:
+                numbers[ref.idnum] = self.next_id
+                self.next_id += 1
+                obj = ref.get_object()
+                objects.append((numbers[ref.idnum], obj))
+                containers.append(obj)
+            return IndirectObject(numbers[ref.idnum], 0, None)
+
+        containers = []
+        for page in reader.pages:
+            self.kids.append(renumber(page.indirect_reference))
+        # Rewrite references in place; the batch reader is thrown away afterwards
+        while containers:
+            container = containers.pop()
+            items = container.items() if isinstance(container, DictionaryObject) else enumerate(container)
+            for key, value in list(items):
+                if key == "/Parent":
+                    container[key] = IndirectObject(self.PAGES_ID, 0, None)
+                elif isinstance(value, IndirectObject):
+                    container[key] = renumber(value)
+                elif isinstance(value, (DictionaryObject, ArrayObject)):
+                    containers.append(value)
+
+        out = io.BytesIO()
+        for idnum, obj in objects:
+            self._write_object(out, idnum, obj)
+        return self._emit(out.getvalue())
+
+    def finish(self):
+        out = io.BytesIO()
+        self._write_object(out, self.PAGES_ID, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(self.kids),
+            NameObject("/Count"): NumberObject(len(self.kids)),
+        }))
+        self._write_object(out, self.CATALOG_ID, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self.PAGES_ID, 0, None),
+        }))
+        xref_at = self.offset + out.tell()
+        out.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode())
+        for idnum in range(1, self.next_id):
+            out.write(f"{self.offsets[idnum]:010d} 00000 n \n".encode())
+        out.write(f"trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode())
+        return self._emit(out.getvalue())
+
+
+async def stream_merged_pdf(cursor):
+    """
+    Yields a single PDF with one page per report. Reports are rendered in
+    batches of MERGE_BATCH_SIZE on the process pool, at most 2 *
+    EXPORT_WORKERS batches at a time, and each batch's pages are sent as
+    soon as it and every batch before it have finished.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    window = EXPORT_WORKERS * 2
+    pending = deque()
+    batch = []
+    writer = _MergedPdfWriter()
+
+    async def write_oldest():
+        # Renumbering is cheap next to rendering; keep it off the event loop all the same
+        return await asyncio.to_thread(writer.add_batch, await pending.popleft())
+
+    try:
+        yield writer.header()
+        async for report in cursor:
+            batch.append(report)
+            if len(batch) >= MERGE_BATCH_SIZE:
+                pending.append(loop.run_in_executor(executor, render_merged_pdf_bytes, batch))
+                batch = []
+                if len(pending) >= window:
+                    yield await write_oldest()
+        if batch:
+            pending.append(loop.run_in_executor(executor, render_merged_pdf_bytes, batch))
+        while pending:
+            yield await write_oldest()
+        yield writer.finish()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,300 @@
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .database import db
+
+# One rollup document per doctor, keyed by doctor_id
+stats_collection = db.report_stats
+# (doctor_id, patient_id) pairs already counted, so unique patients can be maintained incrementally
+patients_collection = db.report_stats_patients
+# Lock document so only one rebuild runs at a time
+locks_collection = db.report_stats_locks
+BACKFILL_LOCK_TTL = int(os.getenv("REPORT_STATS_BACKFILL_LOCK_TTL", "600"))
+# Backfill watermark: reports at or below it are counted by the backfill, the rest by record_report
+meta_collection = db.report_stats_meta
+META_ID = "backfill"
+
+BUCKET_FIELDS = ("by_disorder", "by_severity", "by_month", "by_day")
+
+
+def _key(value):
+    """Mongo field names cannot contain '.' or start with '$'."""
+    text = str(value) if value not in (None, "") else "Unknown"
+    return text.replace(".", "_").replace("$", "_")
+
+
+def _bucket_keys(report):
+    created_at = report.get("created_at")
+    if not isinstance(created_at, datetime):
+        created_at = datetime.utcnow()
+    return {
+        "by_disorder": _key(report.get("disorder")),
+        "by_severity": _key(report.get("severity")),
+        "by_month": created_at.strftime("%Y-%m"),
+        "by_day": created_at.strftime("%Y-%m-%d"),
+    }
+
+
+async def ensure_indexes():
+    await patients_collection.create_index([("doctor_id", 1), ("patient_id", 1)], unique=True)
+
+
+async def _live_reports(reports):
+    """
+    Drops the reports a backfill is responsible for. Before any backfill has
+    claimed the rollups they are all left to it; while one is taking its
+    snapshot they are parked on the meta document for it to count; after
+    that, only reports above its watermark are counted here.
+    """
+    ids = [report["_id"] for report in reports]
+    while True:
+        meta = await meta_collection.find_one({"_id": META_ID}, {"pending_ids": 0})
+        if meta is None:
+            return []
+        if meta["state"] != "pending":
+            watermark = meta.get("watermark")
+            return [r for r in reports if watermark is None or r["_id"] > watermark]
+        parked = await meta_collection.update_one(
+            {"_id": META_ID, "state": "pending"},
+            {"$push": {"pending_ids": {"$each": ids}}},
+        )
+        if parked.matched_count:
+            return []
+        # The snapshot was taken in between; re-read the watermark
+
+
+async def record_report(report):
+    """Folds one newly inserted report into its doctor's rollup."""
+    await record_reports([report])
+
+
+async def record_reports(reports):
+    """
+    Folds newly inserted reports (with their _id) into the rollups. One bulk
+    upsert for the patient set and one $inc per doctor, however many
+    reports there are.
+    """
+    await _apply(await _live_reports(reports))
+
+
+async def _apply(reports):
+    if not reports:
+        return
+    incs = {}
+    patient_ops = {}
+    for report in reports:
+        doctor_id = report["doctor_id"]
+        inc = incs.setdefault(doctor_id, {"total": 0, "confidence_sum": 0.0})
+        inc["total"] += 1
+        inc["confidence_sum"] += float(report.get("confidence") or 0)
+        for field, key in _bucket_keys(report).items():
+            path = f"{field}.{key}"
+            inc[path] = inc.get(path, 0) + 1
+        patient_key = (doctor_id, report.get("patient_id"))
+        if patient_key not in patient_ops:
+            patient_ops[patient_key] = UpdateOne(
+                {"doctor_id": doctor_id, "patient_id": report.get("patient_id")},
+                {"$setOnInsert": {"first_seen": report.get("created_at")}},
+                upsert=True,
+            )
+
+    keys = list(patient_ops)
+    result = await patients_collection.bulk_write(list(patient_ops.values()), ordered=False)
+    for op_index in result.upserted_ids:
+        doctor_id = keys[op_index][0]
+        incs[doctor_id]["unique_patients"] = incs[doctor_id].get("unique_patients", 0) + 1
+
+    now = datetime.utcnow()
+    for doctor_id, inc in incs.items():
+        await stats_collection.update_one({"_id": doctor_id}, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True)
+
+
+async def get_stats(doctor_id):
+    doc = await stats_collection.find_one({"_id": doctor_id})
+    if not doc:
+        doc = {"total": 0, "confidence_sum": 0.0, "unique_patients": 0}
+    total = doc.get("total", 0)
+    return {
+        "doctor_id": doctor_id,
+        "total": total,
+        "unique_patients": doc.get("unique_patients", 0),
+        "average_confidence": doc.get("confidence_sum", 0.0) / total if total else 0.0,
+        **{field: doc.get(field, {}) for field in BUCKET_FIELDS},
+        "updated_at": doc.get("updated_at"),
+    }
+
+
+async def _acquire_backfill_lock(owner):
+    """
+    Upserts the lock document unless another owner holds an unexpired one,
+    in which case the upsert collides on _id and the lock is refused.
+    """
+    now = datetime.utcnow()
+    try:
+        await locks_collection.update_one(
+            {"_id": "backfill", "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=BACKFILL_LOCK_TTL)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _release_backfill_lock(owner):
+    await locks_collection.delete_one({"_id": "backfill", "owner": owner})
+
+
+async def _claim_backfill(owner):
+    """
+    Creates the meta document in the "pending" state. It is created once and
+    never expires, so a backfill can't run twice. A claim that is still
+    pending has counted nothing yet, so a stale one may be taken over.
+    """
+    now = datetime.utcnow()
+    try:
+        await meta_collection.insert_one(
+            {"_id": META_ID, "state": "pending", "claimed_by": owner, "claimed_at": now, "pending_ids": []}
+        )
+        return True
+    except DuplicateKeyError:
+        pass
+    taken = await meta_collection.update_one(
+        {"_id": META_ID, "state": "pending", "claimed_at": {"$lt": now - timedelta(seconds=BACKFILL_LOCK_TTL)}},
+        {"$set": {"claimed_by": owner, "claimed_at": now}},
+    )
+    return taken.modified_count == 1
+
+
+async def backfill(owner):
+    """
+    Counts existing reports into the rollups with server-side aggregations,
+    for data that predates record_report. The caller must hold the claim
+    from _claim_backfill.
+
+    The newest report _id is stored as the watermark in the same update that
+    ends the pending state. Reports at or below it are counted here and
+    skipped by record_report; reports parked while pending that are above it
+    are counted here too, so each report is counted exactly once.
+    """
+    newest = await db.reports.find({}, {"_id": 1}).sort("_id", -1).limit(1).to_list(length=1)
+    watermark = newest[0]["_id"] if newest else None
+    meta = await meta_collection.find_one_and_update(
+        {"_id": META_ID, "state": "pending", "claimed_by": owner},
+        {"$set": {"state": "running", "watermark": watermark, "started_at": datetime.utcnow()}, "$unset": {"pending_ids": ""}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if meta is None:
+        print("Report stats backfill claim was taken over; skipping")
+        return 0
+
+    doctors = await _aggregate(watermark) if watermark is not None else 0
+
+    parked = [i for i in meta.get("pending_ids", []) if watermark is None or i > watermark]
+    if parked:
+        await _apply(await db.reports.find({"_id": {"$in": parked}}).to_list(length=None))
+
+    await meta_collection.update_one({"_id": META_ID}, {"$set": {"state": "complete", "completed_at": datetime.utcnow()}})
+    print(f"Backfilled report stats for {doctors} doctors")
+    return doctors
+
+
+async def _aggregate(watermark):
+    match = {"$match": {"_id": {"$lte": watermark}}}
+    incs = {}
+
+    def inc_for(doctor_id):
+        return incs.setdefault(doctor_id, {})
+
+    pipeline = [match, {"$group": {"_id": "$doctor_id", "total": {"$sum": 1}, "confidence_sum": {"$sum": "$confidence"}}}]
+    async for row in db.reports.aggregate(pipeline, allowDiskUse=True):
+        inc = inc_for(row["_id"])
+        inc["total"] = row["total"]
+        inc["confidence_sum"] = float(row["confidence_sum"] or 0)
+
+    group_keys = {
+        "by_disorder": "$disorder",
+        "by_severity": "$severity",
+        "by_month": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}},
+        "by_day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+    }
+    for field, expr in group_keys.items():
+        pipeline = [match, {"$group": {"_id": {"doctor": "$doctor_id", "key": expr}, "n": {"$sum": 1}}}]
+        async for row in db.reports.aggregate(pipeline, allowDiskUse=True):
+            inc = inc_for(row["_id"]["doctor"])
+            path = f"{field}.{_key(row['_id'].get('key'))}"
+            inc[path] = inc.get(path, 0) + row["n"]
+
+    # Same upsert as record_report: a pair is counted by whichever writer inserts it first
+    async def flush(keys, ops):
+        result = await patients_collection.bulk_write(ops, ordered=False)
+        for op_index in result.upserted_ids:
+            inc = inc_for(keys[op_index])
+            inc["unique_patients"] = inc.get("unique_patients", 0) + 1
+
+    pipeline = [match, {"$group": {"_id": {"doctor_id": "$doctor_id", "patient_id": "$patient_id"}, "first_seen": {"$min": "$created_at"}}}]
+    keys, ops = [], []
+    async for row in db.reports.aggregate(pipeline, allowDiskUse=True):
+        keys.append(row["_id"]["doctor_id"])
+        ops.append(UpdateOne(row["_id"], {"$setOnInsert": {"first_seen": row["first_seen"]}}, upsert=True))
+        if len(ops) >= 1000:
+            await flush(keys, ops)
+            keys, ops = [], []
+    if ops:
+        await flush(keys, ops)
+
+    now = datetime.utcnow()
+    for doctor_id, inc in incs.items():
+        await stats_collection.update_one({"_id": doctor_id}, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True)
+    return len(incs)
+
+
+def _lock_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def rebuild():
+    """
+    CLI entry point: clears every rollup and backfills from scratch under
+    the rebuild lock. Run it while no reports are being written.
+    """
+    owner = _lock_owner()
+    if not await _acquire_backfill_lock(owner):
+        print("Another report stats backfill is already running")
+        return
+    try:
+        # Meta first: from here until the new claim, record_report leaves reports to the backfill
+        await meta_collection.delete_one({"_id": META_ID})
+        await stats_collection.delete_many({})
+        await patients_collection.delete_many({})
+        if await _claim_backfill(owner):
+            await backfill(owner)
+    finally:
+        await _release_backfill_lock(owner)
+
+
+async def backfill_if_needed():
+    """
+    Startup hook. Every worker calls this; the first to claim the meta
+    document runs the backfill, and once it exists nobody backfills again.
+    """
+    owner = _lock_owner()
+    try:
+        if await _claim_backfill(owner):
+            await backfill(owner)
+            return
+        meta = await meta_collection.find_one({"_id": META_ID}, {"state": 1, "started_at": 1})
+        stale = datetime.utcnow() - timedelta(seconds=BACKFILL_LOCK_TTL)
+        if meta and meta["state"] == "running" and meta["started_at"] < stale:
+            print("Report stats backfill did not finish; run `python -m backend.report_stats` to rebuild the rollups")
+    except Exception as e:
+        print(f"Report stats backfill failed: {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
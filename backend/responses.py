@@ -0,0 +1,176 @@
+import gzip
+import hashlib
+
+import orjson
+from bson import ObjectId
+from fastapi import Request
+from fastapi.encoders import ENCODERS_BY_TYPE
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth the CPU to compress
+DEFAULT_MINIMUM_SIZE = 1024
+# Already compressed or streamed content is passed through untouched
+SKIP_CONTENT_TYPES = ("text/event-stream", "application/pdf", "application/zip", "image/")
+
+
+# Plain return values go through FastAPI's jsonable_encoder before render();
+# teach it ObjectId so routes can return raw Mongo documents
+ENCODERS_BY_TYPE[ObjectId] = str
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content):
+    """orjson with native datetime/numpy support plus ObjectId and pydantic models."""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Default response class for the API; renders with orjson. For plain
+    return values FastAPI still runs jsonable_encoder first, so orjson only
+    replaces the final dumps there. Hot routes return an instance directly,
+    which skips that pass and lets _default handle ObjectId and models.
+    """
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def sse_event(event, data):
+    """Formats one Server-Sent Events message with a JSON payload."""
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: ignore the W/ prefix on either side
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+def conditional_json(request: Request, content):
+    """
+    Serializes `content` and tags it with an ETag. Returns 304 with no body
+    when the client already holds the same representation.
+    """
+    body = dumps(content)
+    etag = 'W/"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _choose_encoding(accept_encoding):
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression for single-chunk responses above
+    `minimum_size`. Streaming responses (PDFs, SSE) are never buffered.
+    """
+    def __init__(self, app, minimum_size=DEFAULT_MINIMUM_SIZE, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = _choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                response_headers = {k.lower(): v for k, v in message.get("headers", [])}
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in response_headers or content_type.startswith(SKIP_CONTENT_TYPES):
+                    passthrough = True
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if start_message is not None:
+                if message.get("more_body") or len(body) < self.minimum_size:
+                    # Streaming or small body: send as is
+                    await send(start_message)
+                else:
+                    body = self._compress(body, encoding)
+                    vary = b"Accept-Encoding"
+                    new_headers = []
+                    for k, v in start_message.get("headers", []):
+                        if k.lower() == b"vary":
+                            vary = v + b", Accept-Encoding"
+                        elif k.lower() != b"content-length":
+                            new_headers.append((k, v))
+                    new_headers += [
+                        (b"content-encoding", encoding.encode()),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"vary", vary),
+                    ]
+                    await send({**start_message, "headers": new_headers})
+                    message = {**message, "body": body}
+                start_message = None
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
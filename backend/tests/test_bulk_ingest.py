@@ -0,0 +1,106 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+from bson import ObjectId
+
+from backend import bulk_ingest, report_stats
+from backend.auth import get_current_user
+from backend.main import app
+from backend.models import UserInDB
+
+
+class FakeReports:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        self.docs.extend(docs)
+
+
+class FakeDB:
+    def __init__(self):
+        self.reports = FakeReports()
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakeDB()
+    rolled_up = []
+
+    async def record_reports(docs):
+        rolled_up.extend(docs)
+
+    monkeypatch.setattr(bulk_ingest, "db", fake)
+    monkeypatch.setattr(report_stats, "record_reports", record_reports)
+    app.dependency_overrides[get_current_user] = lambda: UserInDB(username="dr_test", hashed_password="x")
+    yield fake.reports, rolled_up
+    app.dependency_overrides.pop(get_current_user, None)
+
+
+def asgi_app(spec_version):
+    # Uvicorn reports spec_version 2.3 for HTTP, which makes StreamingResponse
+    # listen for disconnects while the body is streamed
+    async def wrapped(scope, receive, send):
+        if scope["type"] == "http":
+            scope = {**scope, "asgi": {**scope.get("asgi", {}), "spec_version": spec_version}}
+        await app(scope, receive, send)
+    return wrapped
+
+
+def record(i):
+    return {"patient_id": f"P{i}", "disorder": "Fracture", "confidence": 0.9, "severity": "Mild", "notes": "n"}
+
+
+def post(body, content_type, spec_version="2.3"):
+    async def run():
+        transport = httpx.ASGITransport(app=asgi_app(spec_version))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.wait_for(
+                client.post("/reports/bulk?chunk_size=100", content=body, headers={"content-type": content_type}),
+                timeout=10,
+            )
+    response = asyncio.run(run())
+    lines = [orjson.loads(line) for line in response.content.splitlines()]
+    return response, lines
+
+
+@pytest.mark.parametrize("spec_version", ["2.3", "2.4"])
+def test_ndjson_body_is_fully_ingested(fake_db, spec_version):
+    reports, rolled_up = fake_db
+    body = b"\n".join(orjson.dumps(record(i)) for i in range(1000)) + b"\n"
+
+    response, lines = post(body, "application/x-ndjson", spec_version)
+
+    assert response.status_code == 200
+    assert lines[-1] == {"summary": {"inserted": 1000, "invalid": 0, "failed": 0}}
+    assert len(reports.docs) == 1000
+    assert len(rolled_up) == 1000
+
+
+def test_json_array_reports_invalid_records(fake_db):
+    reports, _ = fake_db
+    body = orjson.dumps([record(0), {"patient_id": "P1"}, record(2)])
+
+    response, lines = post(body, "application/json")
+
+    assert [line.get("status") for line in lines[:-1]] == ["invalid", "inserted", "inserted"]
+    assert lines[-1] == {"summary": {"inserted": 2, "invalid": 1, "failed": 0}}
+    assert len(reports.docs) == 2
+
+
+def test_rollups_updated_before_statuses_are_sent(fake_db):
+    _, rolled_up = fake_db
+    batch = [(i, bulk_ingest.build_document(bulk_ingest.ReportCreate(**record(i)), "dr_test")) for i in range(3)]
+
+    async def read_one_status():
+        statuses = bulk_ingest._flush(batch)
+        await statuses.__anext__()
+        # The client went away after the first status line
+        await statuses.aclose()
+
+    asyncio.run(read_one_status())
+    assert len(rolled_up) == 3
@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import Dataset, DataLoader
+
+from .unet_model import UNet
+
+
+class ShardDataset(Dataset):
+    """
+    Reads samples written by dataset_packer from memory-mapped shards.
+    Shards are opened lazily so each DataLoader worker maps its own view
+    instead of pickling arrays across processes.
+    """
+    def __init__(self, split_dir, augment=False):
+        with open(os.path.join(split_dir, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        self.split_dir = split_dir
+        self.augment = augment
+        self.prefixes = [s["prefix"] for s in self.manifest["shards"]]
+        self.offsets = np.cumsum([0] + [s["count"] for s in self.manifest["shards"]])
+        self._shards = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _open_shards(self):
+        self._shards = []
+        for prefix in self.prefixes:
+            path = os.path.join(self.split_dir, prefix)
+            images = np.load(path + "_images.npy", mmap_mode="r")
+            masks = np.load(path + "_masks.npy", mmap_mode="r")
+            self._shards.append((images, masks))
+
+    def __getitem__(self, idx):
+        if self._shards is None:
+            self._open_shards()
+        shard_idx = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        local_idx = idx - int(self.offsets[shard_idx])
+        images, masks = self._shards[shard_idx]
+
+        image = np.array(images[local_idx])
+        mask = np.array(masks[local_idx])
+        if self.augment and np.random.rand() < 0.5:
+            image = image[:, ::-1]
+            mask = mask[:, ::-1]
+
+        # Same scaling as T.ToTensor() in /segment
+        image_tensor = torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1))).float().div_(255.0)
+        mask_tensor = torch.from_numpy(np.ascontiguousarray(mask)).float().unsqueeze(0)
+        return image_tensor, mask_tensor
+
+
+def dice_loss(logits, target, eps=1.0):
+    probs = torch.sigmoid(logits)
+    intersection = (probs * target).sum(dim=(1, 2, 3))
+    union = probs.sum(dim=(1, 2, 3)) + target.sum(dim=(1, 2, 3))
+    return 1 - ((2 * intersection + eps) / (union + eps)).mean()
+
+
+def make_loader(split_dir, batch_size, workers, shuffle, augment, pin_memory):
+    dataset = ShardDataset(split_dir, augment=augment)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=workers,
+        pin_memory=pin_memory,
+        persistent_workers=workers > 0,
+        prefetch_factor=4 if workers > 0 else None,
+        drop_last=shuffle,
+    )
+
+
+def evaluate(model, loader, device):
+    """Returns the mean mask IoU over a loader."""
+    model.eval()
+    intersection = 0.0
+    union = 0.0
+    with torch.no_grad():
+        for images, masks in loader:
+            images = images.to(device, non_blocking=True)
+            masks = masks.to(device, non_blocking=True)
+            preds = (torch.sigmoid(model(images)) > 0.5).float()
+            intersection += (preds * masks).sum().item()
+            union += ((preds + masks) > 0).float().sum().item()
+    return intersection / union if union > 0 else 1.0
+
+
+def freeze_encoder(model):
+    """Freezes the contracting path so fine-tuning only adapts the decoder."""
+    for module in (model.inc, model.down1, model.down2, model.down3, model.down4):
+        for param in module.parameters():
+            param.requires_grad = False
+
+
+def train(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    pin_memory = device.type == "cuda"
+
+    train_loader = make_loader(os.path.join(args.data, "train"), args.batch_size, args.workers, True, True, pin_memory)
+    val_dir = os.path.join(args.data, "valid")
+    val_loader = None
+    if os.path.exists(os.path.join(val_dir, "manifest.json")):
+        val_loader = make_loader(val_dir, args.batch_size, args.workers, False, False, pin_memory)
+
+    model = UNet(n_channels=3, n_classes=1).to(device)
+    if args.resume:
+        model.load_state_dict(torch.load(args.resume, map_location=device))
+        print(f"Resumed from {args.resume}")
+    if args.freeze_encoder:
+        freeze_encoder(model)
+
+    params = [p for p in model.parameters() if p.requires_grad]
+    optimizer = torch.optim.AdamW(params, lr=args.lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    bce = nn.BCEWithLogitsLoss()
+
+    best_iou = -1.0
+    for epoch in range(1, args.epochs + 1):
+        model.train()
+        start = time.time()
+        data_time = 0.0
+        total_loss = 0.0
+        batches = 0
+
+        fetch_start = time.time()
+        for images, masks in train_loader:
+            data_time += time.time() - fetch_start
+            images = images.to(device, non_blocking=True)
+            masks = masks.to(device, non_blocking=True)
+
+            optimizer.zero_grad(set_to_none=True)
+            logits = model(images)
+            loss = bce(logits, masks) + dice_loss(logits, masks)
+            loss.backward()
+            optimizer.step()
+
+            total_loss += loss.item()
+            batches += 1
+            fetch_start = time.time()
+
+        scheduler.step()
+        elapsed = time.time() - start
+        msg = f"Epoch {epoch}/{args.epochs} loss={total_loss / max(batches, 1):.4f} time={elapsed:.1f}s data_wait={data_time:.1f}s"
+
+        if val_loader is not None:
+            iou = evaluate(model, val_loader, device)
+            msg += f" val_iou={iou:.4f}"
+        else:
+            iou = -total_loss
+        print(msg)
+
+        if iou > best_iou:
+            best_iou = iou
+            torch.save(model.state_dict(), args.out)
+            print(f"Saved weights to {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or fine-tune the fracture U-Net on packed shards.")
+    parser.add_argument("--data", default=os.path.join("packed", "BoneFractureYolo8"), help="Directory written by dataset_packer")
+    parser.add_argument("--out", default="unet_fracture.pth", help="Where to save the best weights (main.py loads this path)")
+    parser.add_argument("--resume", default=None, help="Existing weights to fine-tune from")
+    parser.add_argument("--freeze-encoder", action="store_true", help="Only train the decoder when fine-tuning")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+    train(args)
+
+
+if __name__ == "__main__":
+    main()
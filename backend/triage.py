@@ -0,0 +1,226 @@
+import argparse
+import os
+import random
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+TRIAGE_SIZE = 224
+TRIAGE_WEIGHTS = os.getenv("TRIAGE_WEIGHTS", "triage.pth")
+# Films scoring below this fracture probability are treated as clearly normal
+TRIAGE_NORMAL_THRESHOLD = float(os.getenv("TRIAGE_NORMAL_THRESHOLD", "0.05"))
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "1").lower() in ("1", "true", "yes")
+# Fraction of would-be skips that still run the full path, to measure how often triage is wrong
+TRIAGE_AUDIT_RATE = float(os.getenv("TRIAGE_AUDIT_RATE", "0.05"))
+
+
+class TriageNet(nn.Module):
+    """Small CNN scoring a 224x224 film as likely fracture vs likely normal."""
+    def __init__(self, width=16):
+        super().__init__()
+        layers = []
+        in_channels = 3
+        for out_channels in (width, width * 2, width * 4, width * 8):
+            layers += [
+                nn.Conv2d(in_channels, out_channels, kernel_size=3, stride=2, padding=1, bias=False),
+                nn.BatchNorm2d(out_channels),
+                nn.ReLU(inplace=True),
+            ]
+            in_channels = out_channels
+        self.features = nn.Sequential(*layers)
+        self.head = nn.Linear(in_channels, 1)
+
+    def forward(self, x):
+        x = self.features(x)
+        x = F.adaptive_avg_pool2d(x, 1).flatten(1)
+        return self.head(x)
+
+
+class TriageClassifier:
+    def __init__(self, model_path=TRIAGE_WEIGHTS):
+        self.model = TriageNet()
+        self.model_loaded = False
+        if model_path and os.path.exists(model_path):
+            try:
+                self.model.load_state_dict(torch.load(model_path, map_location="cpu"))
+                self.model.eval()
+                self.model_loaded = True
+                print(f"Triage model loaded from {model_path}")
+            except Exception as e:
+                print(f"Failed to load triage weights: {e}")
+        else:
+            print("Triage model weights not found; triage disabled.")
+
+    @property
+    def active(self):
+        return TRIAGE_ENABLED and self.model_loaded
+
+    def score(self, img_bgr):
+        """Probability of fracture for the 224x224 BGR image from utils.preprocess_image."""
+        rgb = np.ascontiguousarray(img_bgr[:, :, ::-1].transpose(2, 0, 1))
+        tensor = torch.from_numpy(rgb).float().div_(255.0).unsqueeze(0)
+        with torch.no_grad():
+            return float(torch.sigmoid(self.model(tensor))[0, 0])
+
+    def assess(self, img_bgr, override=False):
+        """
+        Returns a triage decision dict. `skip` is True when the film is a
+        confident normal and the heavy models can be bypassed.
+        """
+        if not self.active:
+            return None
+        start = time.perf_counter()
+        p_fracture = self.score(img_bgr)
+        likely_normal = p_fracture < TRIAGE_NORMAL_THRESHOLD
+        audited = likely_normal and not override and random.random() < TRIAGE_AUDIT_RATE
+        return {
+            "p_fracture": p_fracture,
+            "threshold": TRIAGE_NORMAL_THRESHOLD,
+            "likely_normal": likely_normal,
+            "override": override,
+            "audited": audited,
+            "skip": likely_normal and not override and not audited,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+        }
+
+
+def normal_result(decision):
+    """/analyze-shaped result returned when triage skips the full pipeline."""
+    return {
+        "disorder": "Healthy",
+        "confidence": 1.0 - decision["p_fracture"],
+        "severity": "None",
+        "notes": "Triage screening found no signs of fracture; detailed analysis was skipped.",
+        "detailed_analysis": "A lightweight screening model scored this film as clearly normal, so the full detection and AI analysis were not run.",
+        "recommendations": ["Request a full analysis if clinical symptoms persist"],
+        "damage_location": None,
+        "source": "triage",
+    }
+
+
+async def log_decision(db, username, decision, result=None):
+    """Stores one triage decision. `full_disorder` is set whenever the full path also ran."""
+    entry = {
+        "username": username,
+        **{k: v for k, v in decision.items() if k != "skip"},
+        "skipped": decision["skip"],
+        "full_disorder": result.get("disorder") if result and result.get("source") != "triage" else None,
+        "created_at": datetime.utcnow(),
+    }
+    try:
+        await db.triage_log.insert_one(entry)
+    except Exception as e:
+        print(f"Failed to log triage decision: {e}")
+
+
+async def triage_stats(db):
+    """
+    Compute saved and observed miss rate. Audited and overridden normals ran the
+    full path, so any non-healthy outcome among them is a triage false negative.
+    """
+    pipeline = [
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "skipped": {"$sum": {"$cond": ["$skipped", 1, 0]}},
+            "likely_normal": {"$sum": {"$cond": ["$likely_normal", 1, 0]}},
+            "checked_normals": {"$sum": {"$cond": [
+                {"$and": ["$likely_normal", {"$ne": ["$full_disorder", None]}]}, 1, 0,
+            ]}},
+            "missed": {"$sum": {"$cond": [
+                {"$and": [
+                    "$likely_normal",
+                    {"$ne": ["$full_disorder", None]},
+                    {"$ne": ["$full_disorder", "Healthy"]},
+                ]}, 1, 0,
+            ]}},
+            "avg_latency_ms": {"$avg": "$latency_ms"},
+        }},
+    ]
+    rows = await db.triage_log.aggregate(pipeline).to_list(length=1)
+    if not rows:
+        return {"total": 0, "skipped": 0, "skip_rate": 0.0, "checked_normals": 0, "missed": 0, "miss_rate": None}
+    row = rows[0]
+    row.pop("_id", None)
+    row["skip_rate"] = row["skipped"] / row["total"] if row["total"] else 0.0
+    row["miss_rate"] = row["missed"] / row["checked_normals"] if row["checked_normals"] else None
+    return row
+
+
+# ---- Training on the packed shards from dataset_packer ----
+
+def train(args):
+    from torch.utils.data import DataLoader
+    from .train_unet import ShardDataset
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    def loader(split, shuffle):
+        dataset = ShardDataset(os.path.join(args.data, split), augment=shuffle)
+        return DataLoader(dataset, batch_size=args.batch_size, shuffle=shuffle, num_workers=args.workers,
+                          persistent_workers=args.workers > 0)
+
+    def batch_to_inputs(images, masks):
+        images = F.interpolate(images, size=(TRIAGE_SIZE, TRIAGE_SIZE), mode="bilinear", align_corners=False)
+        # A film is "fracture" if it has any labelled region
+        labels = (masks.flatten(1).amax(dim=1) > 0).float().unsqueeze(1)
+        return images.to(device), labels.to(device)
+
+    train_loader = loader("train", True)
+    val_loader = loader("valid", False)
+
+    model = TriageNet().to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    criterion = nn.BCEWithLogitsLoss()
+
+    best_loss = float("inf")
+    for epoch in range(1, args.epochs + 1):
+        model.train()
+        for images, masks in train_loader:
+            inputs, labels = batch_to_inputs(images, masks)
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(model(inputs), labels)
+            loss.backward()
+            optimizer.step()
+
+        model.eval()
+        val_loss = 0.0
+        batches = 0
+        missed = 0
+        positives = 0
+        with torch.no_grad():
+            for images, masks in val_loader:
+                inputs, labels = batch_to_inputs(images, masks)
+                logits = model(inputs)
+                val_loss += criterion(logits, labels).item()
+                batches += 1
+                normal = torch.sigmoid(logits) < TRIAGE_NORMAL_THRESHOLD
+                missed += int((normal & (labels > 0)).sum())
+                positives += int((labels > 0).sum())
+        val_loss /= max(batches, 1)
+        print(f"Epoch {epoch}/{args.epochs} val_loss={val_loss:.4f} "
+              f"missed_fractures@{TRIAGE_NORMAL_THRESHOLD}={missed}/{positives}")
+
+        if val_loss < best_loss:
+            best_loss = val_loss
+            torch.save(model.state_dict(), args.out)
+            print(f"Saved weights to {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the triage classifier on packed shards.")
+    parser.add_argument("--data", default=os.path.join("packed", "BoneFractureYolo8"))
+    parser.add_argument("--out", default=TRIAGE_WEIGHTS)
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    train(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
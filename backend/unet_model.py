@@ -127,3 +127,31 @@ class UNetInference:
             probs = torch.sigmoid(output)
             mask = probs > 0.5
             return mask.cpu().float()
+
+class OnnxUNetInference:
+    """
+    CPU-only U-Net runner for ONNX exports (including INT8 models written by
+    backend.quantize). Same interface as UNetInference.
+    """
+    def __init__(self, model_path):
+        import onnxruntime as ort
+
+        self.device = torch.device('cpu')
+        self.model_loaded = False
+        try:
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+            self.model_loaded = True
+            print(f"ONNX U-Net model loaded from {model_path}")
+        except Exception as e:
+            print(f"Failed to load ONNX U-Net model: {e}")
+
+    def predict(self, image_tensor):
+        if not self.model_loaded:
+            return None
+
+        logits = self.session.run(None, {self.input_name: image_tensor.cpu().numpy().astype('float32')})[0]
+        # sigmoid(x) > 0.5 is the same as x > 0
+        return torch.from_numpy(logits > 0).float()
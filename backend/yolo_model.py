@@ -2,17 +2,35 @@ from ultralytics import YOLO
 import cv2
 import numpy as np
 import os
+import queue
 from PIL import Image
 
+# Ultralytics predictors keep per-call state and are not safe to share across
+# threads, so concurrent requests each borrow their own model instance
+YOLO_REPLICAS = int(os.getenv("YOLO_REPLICAS", "4"))
+
 class YoloModel:
-    def __init__(self, model_path="best.pt"):
+    def __init__(self, model_path="best.pt", task="detect", replicas=YOLO_REPLICAS):
         # Check if best.pt exists, else fallback
         if not os.path.exists(model_path):
             print(f"Warning: {model_path} not found. Falling back to yolov8n.pt")
             model_path = "yolov8n.pt"
         
-        print(f"Loading YOLO model from: {model_path}")
-        self.model = YOLO(model_path)
+        print(f"Loading YOLO model from: {model_path} ({max(1, replicas)} instance(s))")
+        self.model_path = model_path
+        self.task = task
+        # task must be explicit for exported (e.g. ONNX) weights
+        self.model = YOLO(model_path, task=task)
+        # Every instance is built here, at load time, so no request pays for a cold load
+        self.replicas = [self.model] + [YOLO(model_path, task=task) for _ in range(max(1, replicas) - 1)]
+        self._idle = queue.LifoQueue()
+        for replica in self.replicas:
+            self._idle.put(replica)
+
+    def warm_up(self, image_input):
+        """Runs one inference on every instance; the first call pays for fusing layers and allocating buffers."""
+        for replica in self.replicas:
+            replica(image_input)
 
     def detect_fractures(self, image_input):
         """
@@ -23,7 +41,11 @@ class YoloModel:
             List of dictionaries containing detection results.
         """
         # Run inference
-        results = self.model(image_input)
+        model = self._idle.get()
+        try:
+            results = model(image_input)
+        finally:
+            self._idle.put(model)
         
         detections = []
         for result in results:
@@ -8,8 +8,12 @@ const Analyze = () => {
     const [doctorName, setDoctorName] = useState('');
     const [preview, setPreview] = useState<string | null>(null);
     const [isAnalyzing, setIsAnalyzing] = useState(false);
+    // True from the first preliminary result until the final analysis arrives
+    const [isFinalizing, setIsFinalizing] = useState(false);
     const [result, setResult] = useState<any>(null);
     const fileInputRef = useRef<HTMLInputElement>(null);
+    const readerRef = useRef<ReadableStreamDefaultReader<Uint8Array> | null>(null);
+    const analysisRunRef = useRef(0);
 
     // Fetch user info for doctor name
     useEffect(() => {
@@ -37,9 +41,24 @@ const Analyze = () => {
     const [isDrawing, setIsDrawing] = useState(false);
     const [tool, setTool] = useState<'pen' | 'eraser'>('pen');
 
+    // Stops any in-flight analysis stream so it can't overwrite a newer result
+    const cancelAnalysis = () => {
+        analysisRunRef.current += 1;
+        readerRef.current?.cancel().catch(() => {});
+        readerRef.current = null;
+        setIsAnalyzing(false);
+        setIsFinalizing(false);
+    };
+
+    // Don't leave a stream running after leaving the page
+    useEffect(() => () => {
+        readerRef.current?.cancel().catch(() => {});
+    }, []);
+
     const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
         const selectedFile = e.target.files?.[0];
         if (selectedFile) {
+            cancelAnalysis();
             setFile(selectedFile);
             setPreview(URL.createObjectURL(selectedFile));
             setResult(null);
@@ -50,6 +69,7 @@ const Analyze = () => {
         e.preventDefault();
         const selectedFile = e.dataTransfer.files?.[0];
         if (selectedFile) {
+            cancelAnalysis();
             setFile(selectedFile);
             setPreview(URL.createObjectURL(selectedFile));
             setResult(null);
@@ -57,6 +77,7 @@ const Analyze = () => {
     };
 
     const clearFile = () => {
+        cancelAnalysis();
         setFile(null);
         setPreview(null);
         setResult(null);
@@ -141,15 +162,30 @@ const Analyze = () => {
     const handleAnalyze = async () => {
         if (!file) return;
 
+        cancelAnalysis();
+        const run = analysisRunRef.current;
         setIsAnalyzing(true);
+        setIsFinalizing(true);
         setResult(null);
 
         const formData = new FormData();
         formData.append('file', file);
 
+        const toResult = (data: any) => ({
+            disorder: data.disorder,
+            confidence: data.confidence,
+            heatmap: preview,
+            severity: data.severity,
+            notes: data.notes,
+            detailed_analysis: data.detailed_analysis,
+            recommendations: data.recommendations,
+            damage_location: data.damage_location
+        });
+
         try {
             const token = localStorage.getItem('token');
-            const response = await fetch('http://localhost:8000/analyze', {
+            // Streamed variant: local detections arrive before the Gemini narrative
+            const response = await fetch('http://localhost:8000/analyze/stream', {
                 method: 'POST',
                 headers: {
                     'Authorization': `Bearer ${token}`
@@ -157,31 +193,73 @@ const Analyze = () => {
                 body: formData,
             });
 
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error('Analysis failed');
             }
 
-            const data = await response.json();
-            setResult({
-                disorder: data.disorder,
-                confidence: data.confidence,
-                heatmap: preview,
-                severity: data.severity,
-                notes: data.notes,
-                detailed_analysis: data.detailed_analysis,
-                recommendations: data.recommendations,
-                damage_location: data.damage_location
-            });
+            if (run !== analysisRunRef.current) return;
+            const reader = response.body.getReader();
+            readerRef.current = reader;
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let finalReceived = false;
+
+            while (true) {
+                const { done, value } = await reader.read();
+                // A newer analysis (or a cleared file) superseded this one
+                if (run !== analysisRunRef.current) return;
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // SSE messages are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const message = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let event = 'message';
+                    let data = '';
+                    for (const line of message.split('\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    if (!data) continue;
+                    const payload = JSON.parse(data);
+
+                    if (event === 'detections' && !finalReceived) {
+                        // No preliminary result when the local model couldn't run
+                        if (payload.preliminary) setResult(toResult(payload.preliminary));
+                        setIsAnalyzing(false);
+                    } else if (event === 'error' && payload.stage === 'analysis') {
+                        throw new Error(payload.detail);
+                    } else if (event === 'analysis' || event === 'triage') {
+                        finalReceived = true;
+                        setResult(toResult(payload));
+                        setIsFinalizing(false);
+                    }
+                }
+            }
+
+            if (!finalReceived) {
+                throw new Error('Analysis stream ended early');
+            }
         } catch (error) {
+            if (run !== analysisRunRef.current) return;
             console.error('Error analyzing image:', error);
+            // Don't leave a preliminary result around to be saved
+            setResult(null);
             alert('Failed to analyze image. Please ensure backend is running.');
         } finally {
-            setIsAnalyzing(false);
+            if (run === analysisRunRef.current) {
+                readerRef.current = null;
+                setIsAnalyzing(false);
+                setIsFinalizing(false);
+            }
         }
     };
 
     const handleDownloadReport = async () => {
-        if (!file || !result) return;
+        if (!file || !result || isFinalizing) return;
 
         let fileToSend = file;
         let isAnnotated = false;
@@ -240,7 +318,7 @@ const Analyze = () => {
     };
 
     const handleSaveReport = async () => {
-        if (!file || !result) return;
+        if (!file || !result || isFinalizing) return;
 
         let fileToSend = file;
         let isAnnotated = false;
@@ -408,16 +486,16 @@ const Analyze = () => {
 
                             <button
                                 onClick={handleAnalyze}
-                                disabled={!file || isAnalyzing}
-                                className={`w-full py-4 rounded-xl font-bold text-lg transition-all flex items-center justify-center space-x-2 ${!file || isAnalyzing
+                                disabled={!file || isAnalyzing || isFinalizing}
+                                className={`w-full py-4 rounded-xl font-bold text-lg transition-all flex items-center justify-center space-x-2 ${!file || isAnalyzing || isFinalizing
                                     ? 'bg-gray-700 text-gray-400 cursor-not-allowed'
                                     : 'bg-accent hover:bg-accent/90 text-primary shadow-lg shadow-accent/20'
                                     }`}
                             >
-                                {isAnalyzing ? (
+                                {isAnalyzing || isFinalizing ? (
                                     <>
                                         <Loader className="h-5 w-5 animate-spin" />
-                                        <span>Analyzing...</span>
+                                        <span>{isAnalyzing ? 'Analyzing...' : 'Finalizing...'}</span>
                                     </>
                                 ) : (
                                     <>
@@ -439,13 +517,23 @@ const Analyze = () => {
                                         animate={{ opacity: 1, y: 0 }}
                                         className="space-y-8"
                                     >
-                                        <div className="flex items-center space-x-4 p-4 bg-green-500/10 border border-green-500/20 rounded-xl">
-                                            <CheckCircle className="h-8 w-8 text-green-500" />
-                                            <div>
-                                                <h3 className="text-green-500 font-semibold">Analysis Complete</h3>
-                                                <p className="text-green-400/80 text-sm">Confidence Score: {(result.confidence * 100).toFixed(1)}%</p>
+                                        {isFinalizing ? (
+                                            <div className="flex items-center space-x-4 p-4 bg-yellow-500/10 border border-yellow-500/20 rounded-xl">
+                                                <Loader className="h-8 w-8 text-yellow-500 animate-spin" />
+                                                <div>
+                                                    <h3 className="text-yellow-500 font-semibold">Preliminary Result</h3>
+                                                    <p className="text-yellow-400/80 text-sm">From local detection only; waiting for the full analysis...</p>
+                                                </div>
                                             </div>
-                                        </div>
+                                        ) : (
+                                            <div className="flex items-center space-x-4 p-4 bg-green-500/10 border border-green-500/20 rounded-xl">
+                                                <CheckCircle className="h-8 w-8 text-green-500" />
+                                                <div>
+                                                    <h3 className="text-green-500 font-semibold">Analysis Complete</h3>
+                                                    <p className="text-green-400/80 text-sm">Confidence Score: {(result.confidence * 100).toFixed(1)}%</p>
+                                                </div>
+                                            </div>
+                                        )}
 
                                         <div className="space-y-6">
                                             <div>
@@ -493,14 +581,16 @@ const Analyze = () => {
                                         <div className="pt-6 border-t border-white/10 flex space-x-4">
                                             <button
                                                 onClick={handleSaveReport}
-                                                className="flex-1 bg-accent/10 hover:bg-accent/20 text-accent border border-accent/20 py-3 rounded-lg transition-colors flex items-center justify-center space-x-2"
+                                                disabled={isFinalizing}
+                                                className="flex-1 bg-accent/10 hover:bg-accent/20 text-accent border border-accent/20 py-3 rounded-lg transition-colors flex items-center justify-center space-x-2 disabled:opacity-50 disabled:cursor-not-allowed"
                                             >
                                                 <Save className="h-5 w-5" />
                                                 <span>Save Report</span>
                                             </button>
                                             <button
                                                 onClick={handleDownloadReport}
-                                                className="flex-1 bg-white/5 hover:bg-white/10 text-white py-3 rounded-lg transition-colors flex items-center justify-center space-x-2"
+                                                disabled={isFinalizing}
+                                                className="flex-1 bg-white/5 hover:bg-white/10 text-white py-3 rounded-lg transition-colors flex items-center justify-center space-x-2 disabled:opacity-50 disabled:cursor-not-allowed"
                                             >
                                                 <FileText className="h-5 w-5" />
                                                 <span>Download PDF</span>
@@ -4,6 +4,7 @@ import { Users, Activity, FileText, Search, LogOut, Download } from 'lucide-reac
 const Dashboard = () => {
     const [reports, setReports] = useState<any[]>([]);
     const [user, setUser] = useState<any>(null);
+    const [stats, setStats] = useState<any>(null);
 
     useEffect(() => {
         const fetchData = async () => {
@@ -17,6 +18,12 @@ const Dashboard = () => {
                 });
                 if (reportsRes.ok) setReports(await reportsRes.json());
 
+                // Fetch server-side rollup (covers all reports, not just the listed ones)
+                const statsRes = await fetch('http://localhost:8000/reports/stats', {
+                    headers: { 'Authorization': `Bearer ${token}` }
+                });
+                if (statsRes.ok) setStats(await statsRes.json());
+
                 // Fetch User
                 const userRes = await fetch('http://localhost:8000/users/me', {
                     headers: { 'Authorization': `Bearer ${token}` }
@@ -64,8 +71,8 @@ const Dashboard = () => {
         window.location.href = '/';
     };
 
-    const uniquePatients = new Set(reports.map(r => r.patient_id)).size;
-    const totalScans = reports.length;
+    const uniquePatients = stats ? stats.unique_patients : new Set(reports.map(r => r.patient_id)).size;
+    const totalScans = stats ? stats.total : reports.length;
 
     return (
         <div className="pt-20 pb-16 min-h-screen">